@@ -0,0 +1,291 @@
+import numpy as np
+from collections import Counter
+
+# smallest signed integer type able to hold the codes of k candidates (and the -1 padding)
+def codetype(k):
+    if k < 127:
+        return np.int8
+    elif k < 32767:
+        return np.int16
+    return np.int32
+
+class BallotMatrix():
+    """Integer-coded store of ranked ballots, used by the counting methods of Election.
+    Each candidate (party) is registered under a small integer code, and each distinct ranking
+    is stored once as a row of codes, along with the number of votes cast with it.
+
+    Attributes:
+        cands: candidate names, indexed by their codes
+        index: {name: code} candidate registry
+        rankings: (distinct rankings x ranking depth) array of candidate codes, shorter rankings padded with -1
+        weights: number of votes cast with each ranking
+    """
+    def __init__(self, cands=(), rankings=None, weights=None):
+        self.cands = list(cands)
+        self.index = {c: i for i, c in enumerate(self.cands)}
+        if rankings is None:
+            rankings = np.zeros((0, 0))
+        self.rankings = np.asarray(rankings, dtype=codetype(len(self.cands)))
+        if self.rankings.ndim == 1:
+            self.rankings = self.rankings.reshape(-1, 1)
+        if weights is None:
+            weights = np.ones(len(self.rankings), dtype=np.int64)
+        self.weights = np.asarray(weights)
+        self._ranks = None
+        self._pairs = None
+
+    @classmethod
+    def fromCounter(cls, votetotals):
+        '''Builds the matrix from a {preference tuple: votes} dictionary (Election.votetotals)'''
+        bm = cls()
+        if not votetotals:
+            return bm
+        depth = max(len(vt) for vt in votetotals.keys())
+        rows = [[bm.code(c) for c in vt] + [-1]*(depth-len(vt)) for vt in votetotals.keys()]
+        bm.rankings = np.array(rows, dtype=codetype(len(bm.cands))).reshape(len(rows), depth)
+        bm.weights = np.array(list(votetotals.values()))
+        return bm
+
+    def toCounter(self):
+        '''The ballots as a {preference tuple: votes} Counter'''
+        vt = Counter()
+        for row, w in zip(self.rankings.tolist(), self.weights.tolist()):
+            vt[tuple(self.cands[c] for c in row if c >= 0)] += w
+        return vt
+
+    @classmethod
+    def merge(cls, bms):
+        '''Merges several matrices into one (under a common candidate registry), with one aggregation for all of them'''
+        bm = cls()
+        parts = [(np.array([bm.code(c) for c in b.cands]+[-1])[b.rankings], b.weights) for b in bms if len(b)]
+        if not parts:
+            return bm
+        depth = max(r.shape[1] for r, w in parts)
+        bm.rankings = np.full((sum(len(r) for r, w in parts), depth), -1, dtype=codetype(len(bm.cands)))
+        lo = 0
+        for r, w in parts:
+            bm.rankings[lo:lo+len(r), :r.shape[1]] = r
+            lo += len(r)
+        bm.weights = np.concatenate([w for r, w in parts])
+        bm.compact()
+        return bm
+
+    def __len__(self):
+        return len(self.rankings)
+
+    # the code of a candidate, registering it if it is new
+    def code(self, cand):
+        if cand not in self.index:
+            self.index[cand] = len(self.cands)
+            self.cands.append(cand)
+        return self.index[cand]
+
+    # integer codes of a list of candidates (-1 for unregistered ones)
+    def codes(self, cands):
+        return np.array([self.index.get(c, -1) for c in cands], dtype=np.int64)
+
+    def totVote(self):
+        return self.weights.sum().item()
+
+    # merges rankings (already coded with this registry) and their weights, aggregating identical rankings
+    def add(self, rankings, weights):
+        rankings = np.asarray(rankings)
+        if rankings.ndim == 1:
+            rankings = rankings.reshape(-1, 1)
+        depth = max(self.rankings.shape[1], rankings.shape[1])
+        dtype = codetype(len(self.cands))
+        allr = np.full((len(self.rankings)+len(rankings), depth), -1, dtype=dtype)
+        allr[:len(self.rankings), :self.rankings.shape[1]] = self.rankings
+        allr[len(self.rankings):, :rankings.shape[1]] = rankings
+        self.rankings = allr
+        self.weights = np.concatenate((self.weights, np.asarray(weights)))
+        self.compact()
+
+    # aggregates identical rankings into single rows and drops rankings without votes
+    def compact(self):
+        if len(self.rankings) == 0:
+            return
+        uniq, inv = np.unique(self.rankings, axis=0, return_inverse=True)
+        weights = np.zeros(len(uniq), dtype=self.weights.dtype)
+        np.add.at(weights, inv.ravel(), self.weights)
+        keep = weights != 0
+        self.rankings = uniq[keep]
+        self.weights = weights[keep]
+        self._ranks = None
+        self._pairs = None
+
+    # sums the weights by candidate code, as a list of numbers of the same type as the weights
+    def sums(self, codes, weights):
+        sums = np.bincount(codes, weights, minlength=len(self.cands))
+        if np.issubdtype(self.weights.dtype, np.integer):
+            sums = sums.round().astype(np.int64)
+        return sums.tolist()
+
+    # codes of the candidates that appear at any preference
+    def present(self):
+        return np.unique(self.rankings[self.rankings >= 0])
+
+    def allCands(self):
+        return [self.cands[c] for c in self.present().tolist()]
+
+    def firstprefs(self):
+        if self.rankings.shape[1] == 0:
+            return Counter()
+        has = self.rankings[:, 0] >= 0
+        sums = self.sums(self.rankings[has, 0].astype(np.int64), self.weights[has])
+        return Counter({self.cands[c]: sums[c] for c in np.unique(self.rankings[has, 0]).tolist()})
+
+    # the position of each candidate in each ranking, (ranking depth) where the candidate is not ranked
+    def ranks(self):
+        if self._ranks is None:
+            n, depth = self.rankings.shape
+            self._ranks = np.full((n, len(self.cands)), depth, dtype=codetype(depth+1))
+            rows, cols = np.nonzero(self.rankings >= 0)
+            self._ranks[rows, self.rankings[rows, cols]] = cols
+        return self._ranks
+
+    # the highest preference of each ranking among the continuing candidates (given as codes), -1 for exhausted ballots
+    def tops(self, cont):
+        live = np.zeros(len(self.cands)+1, dtype=bool)
+        live[np.asarray(cont, dtype=np.int64)] = True  # the padding code -1 indexes the last, always dead, slot
+        if self.rankings.shape[1] == 0:
+            return np.full(len(self), -1, dtype=np.int64)
+        ok = live[self.rankings]
+        first = ok.argmax(1)
+        rows = np.arange(len(self))
+        top = self.rankings[rows, first].astype(np.int64)
+        top[~ok[rows, first]] = -1
+        return top
+
+    # votes for each continuing candidate once the votes for others have been transferred,
+    # as a {name: votes} dict in the order of /cands/
+    def tally(self, cands):
+        codes = self.codes(cands)
+        top = self.tops(codes[codes >= 0])
+        valid = top >= 0
+        sums = self.sums(top[valid], self.weights[valid])
+        return {c: (sums[i] if i >= 0 else 0) for c, i in zip(cands, codes.tolist())}
+
+    # pairwise preference matrix, computed in one pass over the ballots and cached:
+    # entry [i][j] is the number of votes ranking candidate i above candidate j (unranked candidates come last).
+    # A ballot ranking i prefers it to every candidate except those it ranks above i, so the matrix is
+    # the ranked votes of each candidate minus the counts of ranked (j above i) pairs.
+    def pairwise(self):
+        if self._pairs is None:
+            k = len(self.cands)
+            n, depth = self.rankings.shape
+            above = np.zeros(k*k)
+            if depth > 1:
+                p, q = np.triu_indices(depth, 1)
+                step = max(1, 2**22//len(p))
+                for lo in range(0, n, step):
+                    r = self.rankings[lo:lo+step].astype(np.int64)
+                    hi, lw = r[:, p], r[:, q]
+                    valid = lw >= 0
+                    w = np.broadcast_to(self.weights[lo:lo+step, None], valid.shape)
+                    above += np.bincount((hi*k+lw)[valid], w[valid], minlength=k*k)
+            valid = self.rankings >= 0
+            ranked = np.bincount(self.rankings[valid].astype(np.int64),
+                                 np.broadcast_to(self.weights[:, None], valid.shape)[valid], minlength=k)
+            pairs = ranked[:, None] - above.reshape(k, k).T
+            np.fill_diagonal(pairs, 0)
+            if np.issubdtype(self.weights.dtype, np.integer):
+                pairs = pairs.round().astype(np.int64)
+            self._pairs = pairs
+        return self._pairs
+
+    # votes preferring a to b and b to a
+    def prefer(self, a, b):
+        if a not in self.index or b not in self.index:
+            depth = self.rankings.shape[1]
+            ranks = self.ranks()
+            ra = ranks[:, self.index[a]] if a in self.index else np.full(len(self), depth)
+            rb = ranks[:, self.index[b]] if b in self.index else np.full(len(self), depth)
+            return self.weights[ra < rb].sum().item(), self.weights[rb < ra].sum().item()
+        pairs = self.pairwise()
+        ia, ib = self.index[a], self.index[b]
+        return pairs[ia, ib].item(), pairs[ib, ia].item()
+
+    # Borda points of each ranked candidate, using the Dowdall (1/n) scores if /frac/ is set
+    def borda(self, frac=False):
+        valid = self.rankings >= 0
+        cols = np.nonzero(valid)[1]
+        if frac:
+            points = self.weights[np.nonzero(valid)[0]]/(cols+1.)
+        else:
+            maxi = valid.sum(1).max()-1
+            points = self.weights[np.nonzero(valid)[0]]*(maxi-cols)
+        codes = self.rankings[valid].astype(np.int64)
+        sums = np.bincount(codes, points, minlength=len(self.cands))
+        if not frac and np.issubdtype(self.weights.dtype, np.integer):
+            sums = sums.round().astype(np.int64)
+        sums = sums.tolist()
+        return Counter({self.cands[c]: sums[c] for c in np.unique(codes).tolist()})
+
+
+class RunoffCount():
+    """Incremental count of a BallotMatrix among a shrinking set of continuing candidates (Instant Runoff stages).
+    Each ballot sits in the pile of its highest continuing preference. When a candidate is eliminated,
+    only the ballots in its pile are moved on to their next continuing preference, so that
+    a whole count takes time roughly linear in the total length of the rankings.
+
+    Attributes:
+        bm: the BallotMatrix being counted
+        votes: current number of votes of each candidate, indexed by code
+        exhausted: number of votes with no continuing preference left
+    """
+    def __init__(self, bm, cands):
+        self.bm = bm
+        codes = bm.codes(cands)
+        self.live = np.zeros(len(bm.cands)+1, dtype=bool)
+        self.live[codes[codes >= 0]] = True
+        self.ptr = np.zeros(len(bm), dtype=np.int64)
+        self.votes = np.zeros(len(bm.cands), dtype=bm.weights.dtype)
+        self.exhausted = 0
+        self.piles = {}
+        self._transfer(np.arange(len(bm)), start=0)
+
+    # moves the ballots in /rows/ to their highest continuing preference at or after position /start/ (+ their pointers)
+    def _transfer(self, rows, start=1):
+        rankings = self.bm.rankings
+        depth = rankings.shape[1]
+        pos = self.ptr[rows] + start
+        while len(rows):
+            more = pos < depth
+            top = np.full(len(rows), -1, dtype=np.int64)
+            top[more] = rankings[rows[more], pos[more]]
+            done = self.live[top] | ~more
+            self.ptr[rows[done]] = pos[done]
+            self._file(rows[done], top[done])
+            rows, pos = rows[~done], pos[~done]+1
+
+    # adds ballots to the piles of their (already found) top continuing preferences
+    def _file(self, rows, top):
+        if not len(rows):
+            return
+        w = self.bm.weights[rows]
+        gone = top < 0
+        self.exhausted += w[gone].sum().item()
+        rows, top, w = rows[~gone], top[~gone], w[~gone]
+        self.votes += np.bincount(top, w, minlength=len(self.votes)).round().astype(self.votes.dtype) \
+            if np.issubdtype(self.votes.dtype, np.integer) else np.bincount(top, w, minlength=len(self.votes))
+        order = np.argsort(top, kind="stable")
+        cs, starts = np.unique(top[order], return_index=True)
+        for c, chunk in zip(cs.tolist(), np.split(rows[order], starts[1:])):
+            self.piles.setdefault(c, []).append(chunk)
+
+    # eliminates a candidate, transferring its ballots to their next continuing preferences
+    def eliminate(self, cand):
+        c = self.bm.index.get(cand, -1)
+        if c < 0 or not self.live[c]:
+            return
+        self.live[c] = False
+        self.votes[c] = 0
+        pile = self.piles.pop(c, [])
+        if pile:
+            self._transfer(np.concatenate(pile))
+
+    # current votes of the given candidates as a {name: votes} dict
+    def tally(self, cands):
+        votes = self.votes.tolist()
+        return {x: (votes[self.bm.index[x]] if x in self.bm.index else 0) for x in cands}
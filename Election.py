@@ -2,7 +2,14 @@ import random
 from collections import Counter
 import numbers
 import math
+import fractions
 import itertools
+import heapq
+import numpy as np
+from BallotMatrix import BallotMatrix, RunoffCount
+
+# stamps given to elections whenever their votes or seats change (so that aggregates of them can be cached)
+stamps = itertools.count()
 
 class Election():
     """Simulates a single-district election, with a number of possible different electoral systems.
@@ -11,26 +18,116 @@ class Election():
     Attributes:
         name : Name string of the election
         votetotals: number of votes cast with each preference sequence
+                    (materialised from the integer-coded ballot store when it is only held in that form)
         firstprefs: number of votes cast by first preference only
         seattotals: number of seats by party/alternative
         positions: political compass (economic, social) positions of parties (used for multi-election simulations)
     """
     def __init__(self, name=""):
         self.name = name
-        self.votetotals = Counter()
+        self._votetotals = Counter()
+        self._ballots = None
+        self._totvote = 0
+        self._votestamp = next(stamps)
         self.firstprefs = Counter()
-        self.seattotals = Counter()
+        self._seattotals = Counter()
+        self._totseats = 0
+        self._seatstamp = next(stamps)
         self.positions = {}
 
+    # The votes are held as a Counter of preference tuples, as an integer-coded BallotMatrix, or both.
+    # Either form is built from the other when needed; votes should only be changed through
+    # the methods below (or by assigning a new votetotals Counter), which keep the two in step,
+    # along with the running total of votes and the stamp of their last change.
+    @property
+    def votetotals(self):
+        if self._votetotals is None:
+            self._votetotals = self._ballots.toCounter()
+        return self._votetotals
+
+    @votetotals.setter
+    def votetotals(self, vt):
+        self._votetotals = vt
+        self._ballots = None
+        self._totvote = None
+        self._votestamp = next(stamps)
+
+    # the votes as an integer-coded BallotMatrix, which is used by the counting methods
+    def ballots(self):
+        if self._ballots is None:
+            self._ballots = BallotMatrix.fromCounter(self._votetotals)
+        return self._ballots
+
+    # keeps the votes in the integer-coded form only, which takes much less memory than the Counter of tuples
+    def packVotes(self):
+        self.ballots()
+        self._votetotals = None
+
+    # replaces the votes with those of a BallotMatrix (with no repeated rankings)
+    def setBallots(self,bm):
+        self._ballots = bm
+        self._votetotals = None
+        self._totvote = bm.totVote()
+        self._votestamp = next(stamps)
+        self.firstprefs = bm.firstprefs()
+
     def addVote(self,*vote) :
         if vote:
             self.votetotals[vote] += 1
             self.firstprefs[vote[0]] += 1
+            self._ballots = None
+            self._votestamp = next(stamps)
+            if self._totvote is not None:
+                self._totvote += 1
 
     def addVotes(self,n,*vote) :
         if vote:
             self.votetotals[vote] += n
             self.firstprefs[vote[0]] += n
+            self._ballots = None
+            self._votestamp = next(stamps)
+            if self._totvote is not None:
+                self._totvote += n
+
+    # adds votes in bulk, with one aggregation for all of them
+    def addBallots(self,rankings,counts=1,cands=None):
+        '''Parameters:
+        rankings: preference sequences of candidate names (a 2D array, padded with "" or None if needed, or a list of tuples),
+                  integer-coded rankings (rows of indices into /cands/, padded with -1) if /cands/ is given, or a BallotMatrix
+        counts: number of votes cast with each ranking (or one number for all of them)
+        '''
+        cands, codes, counts = codeballots(rankings,counts,cands)
+        self.addRankings(cands,codes,counts)
+
+    # adds votes in bulk from an iterable of (ranking, count) pairs, aggregating /chunksize/ of them at a time
+    def addBallotRows(self,rows,chunksize=100000,cands=None):
+        rows = iter(rows)
+        chunk = list(itertools.islice(rows,chunksize))
+        while chunk:
+            self.addBallots([r[0] for r in chunk],np.array([r[1] for r in chunk]),cands)
+            chunk = list(itertools.islice(rows,chunksize))
+
+    # adds votes in bulk: integer-coded /rankings/ (rows of indices into /cands/, padded with -1),
+    # each cast /weights/ times, merged into the ballots with one aggregation
+    def addRankings(self,cands,rankings,weights):
+        rankings = np.asarray(rankings)
+        if rankings.ndim == 1:
+            rankings = rankings.reshape(-1,1)
+        if not len(rankings):
+            return
+        bm = self.ballots()
+        recode = np.array([bm.code(c) for c in cands]+[-1])
+        rankings = recode[rankings] # the padding -1 picks the last entry
+        bm.add(rankings,weights)
+        self._votetotals = None
+        self._votestamp = next(stamps)
+        if self._totvote is not None:
+            self._totvote += np.asarray(weights).sum().item()
+        first = rankings[:,0]
+        has = first >= 0
+        fsums = bm.sums(first[has],np.asarray(weights)[has])
+        for c in np.unique(first[has]).tolist():
+            self.firstprefs[bm.cands[c]] += fsums[c]
 
     def addPos(self,cand,econ=random.gauss(0,0.5),soc=random.gauss(0,1)):
         self.positions[cand] = (econ,soc)
@@ -39,25 +136,46 @@ class Election():
         for p in args:
             self.addPos(*p)
 
+    # The seat results, with their running total. Seats are given by adding to the seattotals Counter
+    # (self.seattotals += ...) or by assigning a new one; either way the total is recounted when next needed.
+    @property
+    def seattotals(self):
+        return self._seattotals
+
+    @seattotals.setter
+    def seattotals(self, st):
+        self._seattotals = st
+        self._totseats = None
+        self._seatstamp = next(stamps)
+
     def clearVotes(self):
-        self.votetotals.clear()
+        self.votetotals = Counter()
         self.firstprefs.clear()
+        self._totvote = 0
 
     def clearSeats(self):
-        self.seattotals.clear()
+        self._seattotals.clear()
+        self._totseats = 0
+        self._seatstamp = next(stamps)
 
     def clearEverything(self) :
-        self.votetotals.clear()
-        self.firstprefs.clear()
-        self.seattotals.clear()
+        self.clearVotes()
+        self.clearSeats()
         self.positions.clear()
 
     # tot = total
     def totVote(self):
-        return sum(self.votetotals.values())
+        if self._totvote is None:
+            if self._ballots is not None:
+                self._totvote = self._ballots.totVote()
+            else:
+                self._totvote = sum(self._votetotals.values())
+        return self._totvote
 
     def totSeats(self):
-        return sum(self.seattotals.values())
+        if self._totseats is None:
+            self._totseats = sum(self._seattotals.values())
+        return self._totseats
 
     # returns the candidate with the most votes in the /stat/ count (first preference votes by default). ties are resolved randomly.
     # return format: winner's (name, votes, margin of victory, number of winners)
@@ -92,15 +210,7 @@ class Election():
 
     # result of a one-to-one match between candidate/parties a and b
     def preference(self,a,b,*args):
-        tot = {a:0,b:0}
-        for vt in self.votetotals.keys():
-            i = 0
-            while vt[i] not in [a,b]:
-                i += 1
-                if i >= len(vt):
-                    break
-            if i < len(vt):
-                tot[vt[i]] += self.votetotals[vt]
+        tot = dict(zip((a,b),self.ballots().prefer(a,b)))
         if "s" in args :
             tots = [x[0] for x in valsorted(tot)]
             pcts = percentages(tot)
@@ -111,11 +221,20 @@ class Election():
 
     # set of all candidates (aka alternatives or parties) for which any vote has been given at any preference
     def allCands(self):
-        allcands = set()
-        for vt in self.votetotals.keys() :
-            for v in vt :
-                allcands.add(v)
-        return list(allcands)
+        return self.ballots().allCands()
+
+    # the candidates of allCands and their pairwise preference matrix (cached until the votes change),
+    # where entry [i][j] is the number of votes ranking the ith candidate above the jth
+    def pairwise(self):
+        bm = self.ballots()
+        codes = bm.present()
+        return [bm.cands[c] for c in codes.tolist()], bm.pairwise()[np.ix_(codes,codes)]
+
+    # candidates sorted by a score (highest first), with ties between them resolved randomly
+    def scoreRanking(self,scores):
+        ranking = list(scores.keys())
+        random.shuffle(ranking)
+        return sorted(ranking,key=lambda l:scores[l],reverse=True)
 
     # [BEGIN] Single-winner electoral systems
     
@@ -193,15 +312,7 @@ class Election():
             print("and"),
             print(finalists[-1]),
             print("advance to the second round.")
-        finvotes = {f: 0 for f in finalists}
-        for vt in self.votetotals.keys() :
-            i=0
-            while vt[i] not in finalists :
-                i += 1
-                if i >= len(vt) :
-                    break
-            if i < len(vt) :
-                finvotes[vt[i]] += self.votetotals[vt]
+        finvotes = self.ballots().tally(finalists)
         finalwinner = self.plurality(finvotes)
         if "s" in args :
             finpcts = self.percentages(finvotes)
@@ -217,7 +328,7 @@ class Election():
 
     # Instant Runoff Voting
     def IRV(self,*args) :
-        cands = self.firstprefs.keys()
+        runoff = RunoffCount(self.ballots(),list(self.firstprefs.keys()))
         eliminated = []
         count = 1
         sortedvotes = sorted(self.firstprefs.items(), key=lambda r: r[1],reverse=True)
@@ -248,15 +359,8 @@ class Election():
             if "s" in args :
                 print("%s is eliminated at count %d."%(eliminated[-1],count))
             count += 1
-            stagevotes = {v[0]: 0 for v in sortedvotes}
-            for vt in self.votetotals.keys() :
-                i=0
-                while vt[i] in eliminated or vt[i] not in cands:
-                    i += 1
-                    if i >= len(vt) :
-                        break
-                if i < len(vt) :
-                    stagevotes[vt[i]] += self.votetotals[vt]
+            runoff.eliminate(eliminated[-1])
+            stagevotes = runoff.tally([v[0] for v in sortedvotes])
             del sortedvotes
             del pcts
             sortedvotes = sorted(stagevotes.items(), key=lambda r: r[1],reverse=True)
@@ -276,20 +380,7 @@ class Election():
         '''
         if "s" in args:
             print("An election in the %s constituency\nhas been conducted under the Borda Count." % self.name)
-        maxi = len(max(self.votetotals.keys(),key=lambda l:len(l)))-1
-        bcount = Counter()
-        if "frac" in args :
-            for vt in self.votetotals.keys():
-                i = 0
-                while i < len(vt):
-                    bcount[vt[i]] += self.votetotals[vt]/(i+1.)
-                    i += 1
-        else :
-            for vt in self.votetotals.keys():
-                i = 0
-                while i < len(vt):
-                    bcount[vt[i]] += self.votetotals[vt] * (maxi - i)
-                    i += 1
+        bcount = self.ballots().borda("frac" in args)
         bordaplur = self.plurality(bcount)
         if "s" in args:
             sortedborda = valsorted(bcount)
@@ -314,57 +405,47 @@ class Election():
         if "s" in args:
             print("An election in the %s constituency\nhas been conducted under the Ranked Pairs system." % self.name)
             print("The pair preferences, sorted by the votes of the winner, are as follows:")
-        pairs = itertools.combinations(self.allCands(),2)
+        cands, pm = self.pairwise()
+        pm = pm.tolist()
         rpairs = {}
-        for p in pairs:
-            ppref = self.preference(*p)
-            rpairs[(ppref[0],p[p.index(ppref[0])-1])] = ppref[1]
+        for i, j in itertools.combinations(range(len(cands)),2):
+            if pm[i][j] > pm[j][i]:
+                rpairs[(cands[i],cands[j])] = pm[i][j]
+            elif pm[j][i] > pm[i][j]:
+                rpairs[(cands[j],cands[i])] = pm[j][i]
+            else:
+                ppref = self.plurality({cands[i]:pm[i][j],cands[j]:pm[j][i]})
+                rpairs[(ppref[0],cands[j] if ppref[0]==cands[i] else cands[i])] = ppref[1]
         rpairskeys = [x[0] for x in valsorted(rpairs)]
-        paths = []
-        finranking = []
+        # The locked pairs form a directed graph, whose transitive closure is kept as a boolean matrix
+        # (reach[i][j]: alternative j can be reached from alternative i), so that checking whether
+        # a pair would create a cycle takes constant time.
+        idx = {c: i for i, c in enumerate(cands)}
+        reach = np.zeros((len(cands),len(cands)),dtype=bool)
+        locked = []
         for rp in rpairskeys:
             if "s" in args:
                 self.preference(rp[0],rp[1],"s")
-            tpaths = paths[:]
-            cycle = False
-            for tp in tpaths :
-                if tp[0] == rp[1] and tp[-1] == rp[0] :
-                    cycle = True
-                    break
-                if tp[0] == rp[1] :
-                    tpaths.append([rp[0]]+tp)
-                if tp[-1] == rp[0] :
-                    tpaths.append(tp+[rp[1]])
-            if not cycle :
-                tpaths.append(list(rp))
-                paths = tpaths[:]
-                if rp[0] in finranking and rp[1] in finranking:
-                    wrank = finranking.index(rp[0])
-                    lrank = finranking.index(rp[1])
-                    if wrank > lrank :
-                        finranking.remove(rp[0])
-                        finranking.insert(lrank,rp[0])
-                elif rp[0] in finranking:
-                    finranking.insert(finranking.index(rp[0])+1,rp[1])
-                elif rp[1] in finranking:
-                    finranking.insert(finranking.index(rp[1]),rp[0])
-                else :
-                    finranking += rp[:]
-                if "paths" in args :
-                    print(paths)
-                if "s" in args :
-                    print(finranking[0]),
-                    for r in finranking[1:]:
-                        print("> %s" % r),
-                    print("")
-            elif "s" in args:
-                print("The pair is not locked in due to the cycle that would be created.")
-        
+            w, l = idx[rp[0]], idx[rp[1]]
+            if reach[l,w]:
+                if "s" in args:
+                    print("The pair is not locked in due to the cycle that would be created.")
+                continue
+            locked.append(rp)
+            if not reach[w,l]:
+                upstream = reach[:,w].copy()
+                upstream[w] = True
+                downstream = reach[l].copy()
+                downstream[l] = True
+                reach |= upstream[:,None] & downstream[None,:]
+            if "paths" in args :
+                print(locked)
+            if "s" in args :
+                print(" > ".join(rpranking([c for c in cands if reach[idx[c]].any() or reach[:,idx[c]].any()],reach,idx)))
+
+        finranking = rpranking(cands,reach,idx)
         if "s" in args:
-            print("\nThe final ranking is %s"%finranking[0]),
-            for r in finranking[1:] :
-                print("> %s"%r),
-            print("")
+            print("\nThe final ranking is %s" % " > ".join(finranking))
         if "stot" in args:
             return {finranking[0]:1}
         elif "rank" in args:
@@ -373,6 +454,80 @@ class Election():
             return self.preference(finranking[0],finranking[1])
 
 
+    # Schulze method (a Condorcet method based on the strongest paths between candidates)
+    def Schulze(self,*args):
+        '''Function-specific arg options:
+        "rank": return a list of alternatives in the order of their final Schulze ranking
+        "stat": return a Counter of the number of other alternatives each alternative beats through its strongest paths
+        '''
+        cands, pm = self.pairwise()
+        strength = np.where(pm > pm.T, pm, 0)
+        for k in range(len(cands)):
+            strength = np.maximum(strength, np.minimum(strength[:,k:k+1], strength[k:k+1,:]))
+        scount = Counter(dict(zip(cands,(strength > strength.T).sum(1).tolist())))
+        ranking = self.scoreRanking(scount)
+        if "s" in args:
+            print("An election in the %s constituency\nhas been conducted under the Schulze method." % self.name)
+            print("The numbers of alternatives beaten through the strongest paths are as follows:")
+            for v in ranking :
+                print("\n%s :\t%d" % (v,scount[v]))
+            print("\nThe final ranking is %s" % " > ".join(ranking))
+        if "stot" in args:
+            return {ranking[0]:1}
+        elif "rank" in args:
+            return ranking
+        elif "stat" in args:
+            return scount
+        return self.preference(ranking[0],ranking[1])
+
+    # Minimax (a Condorcet method electing the alternative whose worst one-to-one defeat is the smallest)
+    def minimax(self,*args):
+        '''Function-specific arg options:
+        "rank": return a list of alternatives in the order of their final minimax ranking
+        "stat": return a Counter of the votes against each alternative in its worst one-to-one defeat (as negative numbers)
+        '''
+        cands, pm = self.pairwise()
+        defeats = np.where(pm > pm.T, pm, 0)
+        mcount = Counter(dict(zip(cands,(-defeats.max(0)).tolist()))) if cands else Counter()
+        ranking = self.scoreRanking(mcount)
+        if "s" in args:
+            print("An election in the %s constituency\nhas been conducted under the Minimax method." % self.name)
+            print("The votes against each alternative in its worst one-to-one defeat are as follows:")
+            for v in ranking :
+                print("\n%s :\t%d" % (v,-mcount[v]))
+            print("\nThe final ranking is %s" % " > ".join(ranking))
+        if "stot" in args:
+            return {ranking[0]:1}
+        elif "rank" in args:
+            return ranking
+        elif "stat" in args:
+            return mcount
+        return self.preference(ranking[0],ranking[1])
+
+    # Copeland's method (a Condorcet method counting one-to-one victories, with half a point for a tie)
+    def Copeland(self,*args):
+        '''Function-specific arg options:
+        "rank": return a list of alternatives in the order of their Copeland scores
+        "stat": return a Counter of the Copeland scores of all alternatives
+        '''
+        cands, pm = self.pairwise()
+        scores = (pm > pm.T).sum(1) + 0.5*((pm == pm.T).sum(1)-1)
+        ccount = Counter(dict(zip(cands,scores.tolist())))
+        ranking = self.scoreRanking(ccount)
+        if "s" in args:
+            print("An election in the %s constituency\nhas been conducted under Copeland's method." % self.name)
+            print("The Copeland scores are as follows:")
+            for v in ranking :
+                print("\n%s :\t%.1f" % (v,ccount[v]))
+            print("\nThe final ranking is %s" % " > ".join(ranking))
+        if "stot" in args:
+            return {ranking[0]:1}
+        elif "rank" in args:
+            return ranking
+        elif "stat" in args:
+            return ccount
+        return self.preference(ranking[0],ranking[1])
+
     # [END] Single-winner electoral systems
     
     # Multi-winner seat distribution between alternatives (parties) under Party-list Proportional representation
@@ -393,13 +548,15 @@ class Election():
 
         The smaller this interval is, the less proportional the result.
 
+        "bisect": with a highest averages method (or "hh"), find the critical divisor directly instead of
+                  giving the seats one at a time (much faster for very large numbers of seats, same result)
         '''
         prseats = {x: 0 for x in self.firstprefs.keys()}
-        filledseats = 0
         if "lr" in args or "lrd" in args:
-            quota = self.totVote()*1./seats
+            totvote = self.totVote()
+            quota = totvote*1./seats
             if "lrd" in args:
-                quota = self.totVote()/(seats+1.)
+                quota = totvote/(seats+1.)
             seatcredit = {x[0]:x[1]/quota for x in self.firstprefs.items()}
             prseats = {x[0]:int(x[1]) for x in seatcredit.items()}
             seatcredit = dict(Counter(seatcredit)-Counter(prseats))
@@ -407,27 +564,14 @@ class Election():
             for x in remseats :
                 prseats[x[0]] += 1
         elif "hh" in args:
-            prseats = {x: 1 for x in self.firstprefs.keys()}
-            filledseats = len(self.firstprefs)
-            runningvotes = dict(self.firstprefs.items())
-            while filledseats < seats :
-                pick = max(runningvotes.items(),key=lambda l:l[1])[0]
-                runningvotes[pick] = runningvotes[pick]*math.sqrt(prseats[pick]*(prseats[pick]+1))/\
-                                     math.sqrt((prseats[pick]+1)*(prseats[pick]+2))
-                prseats[pick] += 1
-                filledseats += 1
+            prseats = hiavg(self.firstprefs,seats,hh=True,bisect="bisect" in args)
         else:
             divinterval = 1
             if len(args) > 0:
                 numargs = [x for x in list(args) if isinstance(x, numbers.Number)]
                 if len(numargs)>0:
                     divinterval = numargs[0]
-            runningvotes = dict(self.firstprefs.items())
-            while filledseats < seats :
-                pick = max(runningvotes.items(),key=lambda l:l[1])[0]
-                runningvotes[pick] = runningvotes[pick]*(1.+divinterval*prseats[pick])/(1.+divinterval*(prseats[pick]+1))
-                prseats[pick] += 1
-                filledseats += 1
+            prseats = hiavg(self.firstprefs,seats,divinterval,bisect="bisect" in args)
         if "s" in args :
             vpcts = percentages(self.firstprefs)
             spcts = percentages(prseats)
@@ -450,6 +594,7 @@ class Election():
     # the Single Transferable Vote being the closest real-life approximation. 
     def IRVlistPR(self,seats,*args):
         runningvotes = dict(self.firstprefs.items())
+        runoff = RunoffCount(self.ballots(),list(runningvotes.keys()))
         irvprseats = listPR(runningvotes,seats,*[x for x in args if not x=="s"])
         stage = 1
         if "s" in args :
@@ -473,19 +618,11 @@ class Election():
                 eliminable = len([x for x in sv if x[1]==sv[-1][1]])
                 eliminee = random.randint(1,eliminable)
                 irvprseats.pop(sv[-eliminee][0])
+            runoff.eliminate(sv[-eliminee][0])
             if "s" in args :
                 print("%s is eliminated at stage %d."%(sv[-eliminee][0],stage))
             stage += 1
-            cands = irvprseats.keys()
-            runningvotes = {x:0 for x in cands}
-            for vt in self.votetotals.keys() :
-                i=0
-                while vt[i] not in cands:
-                    i += 1
-                    if i >= len(vt) :
-                        break
-                if i < len(vt) :
-                    runningvotes[vt[i]] += self.votetotals[vt]
+            runningvotes = runoff.tally(list(irvprseats.keys()))
             irvprseats = listPR(runningvotes,seats,*[x for x in args if not x=="s"])
             if "s" in args:
                 vpcts = percentages(runningvotes)
@@ -500,6 +637,39 @@ class Election():
                     print("\nAll voters are represented at the final stage (%d)"%stage)
         return irvprseats
 
+    # Mixed-member proportional representation: list seats added to the seats already held in the election,
+    # e.g. constituency seats imported by a SuperElection, which can run this as its at-large election:
+    # runGenElection("FPTP", al=("MMP", 598, 2, 5, "level"))
+    def MMP(self,seats,*args):
+        '''Arg options:
+        Numeric arguments, in this order:
+            the interval between divisors (1 for D'Hondt (default), 2 for Sainte-Lague, see listPR)
+            the threshold percentage of list votes for list seats (default 0)
+            the number of constituency seats that exempts a party from the threshold (default none)
+
+        Overhang (more constituency seats than a proportional share of /seats/):
+            "oh": overhang seats are added to the assembly
+            "level": levelling seats are added until the result is proportional again
+        By default, the list seats top up the constituency seats of the other parties within /seats/ (see mmpseats).
+        '''
+        numargs = [x for x in args if isinstance(x, numbers.Number)]
+        divinterval, thresh, exempt = (numargs+[1,0,0][len(numargs):])[:3]
+        method = "level" if "level" in args else "oh" if "oh" in args else "ams"
+        held = dict(self.seattotals)
+        totseats = mmpseats(self.firstprefs,held,seats,divinterval,thresh,1,exempt,method)
+        listseats = {x: totseats[x]-held.get(x,0) for x in totseats.keys()}
+        if "s" in args :
+            vpcts = percentages(self.firstprefs)
+            spcts = percentages(totseats)
+            print("A mixed-member proportional election is conducted for %d seats in the %s constituency."%(seats,self.name))
+            print("The list votes and the corresponding seats (of which list seats) are as follows:")
+            print("List  \tVotes\t(pct)\tSeats\t(pct)\tList")
+            sortvs = sorted(totseats.keys(),key=lambda l:-self.firstprefs.get(l,0))
+            for v in sortvs :
+                print("\n%s :\t%d\t(%.2f)\t%d\t(%.2f)\t%d" % (v,self.firstprefs.get(v,0),vpcts.get(v,0),totseats[v],spcts[v],listseats[v]))
+            print("\nTotal seats: %d\n"%sum(totseats.values()))
+        return listseats
+
     # Assigns the seat results under a specified electoral system as the seat total of the election
     def runElection(self,*args,**kwargs) :
         '''args:
@@ -507,7 +677,7 @@ class Election():
         subsequent arguments: parameters of the electoral system (mainly used for listPR/IRVlistPR), which are passed on to the function implementing the electoral system
         '''
         if "supp" not in kwargs:
-            self.seattotals.clear()
+            self.clearSeats()
         
         if "mstr" in args :
             print(valsorted(self.firstprefs))
@@ -531,6 +701,12 @@ class Election():
             self.seattotals += getattr(self,args[0])(*(list(args)[1:]+["stot"]))
         
 
+# Topological sort of a locked Ranked Pairs graph given its transitive closure (/reach/, indexed through /idx/):
+# an alternative that reaches another one always reaches more alternatives than it does.
+def rpranking(cands,reach,idx):
+    nreach = reach.sum(1)
+    return sorted(cands,key=lambda l:-nreach[idx[l]])
+
 # List of dictionary items (key-value pairs) sorted in a decreasing order of value
 def valsorted(stat):
     return sorted(stat.items(),key=lambda l:l[1],reverse=True)
@@ -542,10 +718,192 @@ def percentages(stat,rounding=-1) :
     else:
         return {n: stat[n]*100./totvotes for n in stat.keys()}
 
+# Highest averages seat allocation of /seats/ seats based on a party-vote dictionary (/stat/), using
+# either divisors with an interval of /divinterval/ between consecutive seats (1 for d'Hondt, 2 for Sainte-Lague),
+# or the Huntington-Hill method (/hh/), where every party starts with one seat.
+# Seats are given one at a time from a priority queue of the running averages, or, if /bisect/ is set,
+# mostly at once by searching for the critical divisor. Both give the same result as giving each seat
+# to the first party with the highest running average. The divisor search falls back to the queue
+# when the last seats are too close to call.
+# If a party-seat dictionary /floor/ is given, the parties start with those seats (e.g. constituency seats
+# in a mixed-member system), and the allocation continues from their averages until /seats/ are filled.
+def hiavg(stat,seats,divinterval=1,hh=False,bisect=False,floor=None):
+    if bisect:
+        prseats = bisectseats(stat,seats,divinterval,hh,floor)
+        if prseats is not None:
+            return prseats
+    prseats = {x: max(int(hh),floor.get(x,0) if floor else 0) for x in stat.keys()}
+    filledseats = sum(prseats.values())
+
+    # average for the next seat of a party, computed afresh from its votes so that exact ties stay exact
+    def avg(x):
+        if hh:
+            return stat[x]*math.sqrt(2)/math.sqrt(prseats[x]*(prseats[x]+1))
+        return stat[x]/(1.+divinterval*prseats[x])
+
+    heap = [(-avg(x),i,x) for i, x in enumerate(stat.keys())]
+    heapq.heapify(heap)
+    while filledseats < seats :
+        negvotes, i, pick = heapq.heappop(heap)
+        prseats[pick] += 1
+        filledseats += 1
+        heapq.heappush(heap,(-avg(pick),i,pick))
+    return prseats
+
+# the critical divisor search of hiavg, returning None when the result has to be checked seat by seat
+def bisectseats(stat,seats,divinterval=1,hh=False,floor=None):
+    names = list(stat.keys())
+    votes = np.array([stat[x] for x in names],dtype=float)
+    base = np.array([max(int(hh),floor.get(x,0) if floor else 0) for x in names],dtype=np.int64)
+    if not len(names) or seats <= base.sum() or not (hh or divinterval > 0) \
+            or not np.isfinite(votes).all() or not (votes > 0).any():
+        return None
+    pos = votes > 0
+
+    # average (quotient) for the next seat of parties holding /held/ seats
+    def quot(held):
+        if hh:
+            return votes*math.sqrt(2)/np.sqrt(np.maximum(held,1)*(held+1.))
+        return votes/(1.+divinterval*held)
+
+    # seats held by each party if every average above /lim/ gets a seat
+    def count(lim):
+        if hh:
+            x = (-1+np.sqrt(1+8*(votes/lim)**2))/2
+            held = np.where(pos,1+np.maximum(0,np.ceil(x)-1),1)
+        else:
+            held = np.where(pos,np.maximum(0,np.ceil((votes/lim-1)/divinterval)),0)
+        return np.maximum(held,base)
+
+    hi = votes.max()
+    if count(hi).sum() > seats:
+        return None
+    lo = hi
+    for i in range(2100):
+        lo /= 2
+        if count(lo).sum() > seats:
+            break
+    else:
+        return None
+    while True:
+        mid = (lo+hi)/2
+        if not lo < mid < hi:
+            break
+        if count(mid).sum() > seats:
+            lo = mid
+        else:
+            hi = mid
+    held = count(hi).astype(np.int64)
+    if held.sum() > seats:
+        return None
+    # the remaining (tied or nearly tied) seats
+    nextq = quot(held)
+    heap = [(-q,i) for i, q in enumerate(nextq.tolist())]
+    heapq.heapify(heap)
+    for s in range(seats-held.sum()):
+        i = heapq.heappop(heap)[1]
+        held[i] += 1
+        heapq.heappush(heap,(-quot(held)[i],i))
+    # the result is only certain if the last seat given clearly beats the first one not given
+    given = held > base
+    if given.any() and quot(held-given)[given].min() <= quot(held).max()*(1+1e-9):
+        return None
+    return dict(zip(names,held.tolist()))
+
+# Mixed-member proportional seat allocation: /listvotes/ and /constseats/ are party-vote and party-seat dictionaries
+# (list votes and the constituency seats won by each party, e.g. from FPTP), and /seats/ is the size of the assembly
+# before any overhang or levelling seats. Seats are allocated with divisors /divinterval/ apart (as in hiavg) among
+# the parties with at least /thresh/ percent of the list votes, the /minpties/ parties with the most list votes
+# and, if /exempt/ is set, those winning at least /exempt/ constituencies.
+# The constituency seats of the other parties (and of independents) are kept, and taken off the seats to be distributed
+# unless /deduct/ is False (in which case they come on top of /seats/).
+# /method/ decides how parties winning more constituencies than their proportional share (overhang) are dealt with:
+#   "ams": the list seats of the others are topped up from their constituency seats until all /seats/ are filled
+#          (as in the Scottish Additional Member System), so overhang comes out of the other parties' share
+#   "oh": every party gets the larger of its proportional share and its constituency seats, with overhang seats added
+#   "level": the assembly is enlarged until every party's proportional share covers its constituency seats
+#            (levelling seats as in the German Bundestag after 2013), so that the result stays proportional
+# All of these are found by divisor searches (see bisectseats) rather than seat by seat; the enlarged size of a levelled
+# assembly is the number of averages at least as large as the critical average of the party that needs most levelling,
+# with the averages compared exactly (as fractions), so that exact ties go to the earlier party as in hiavg.
+def mmpseats(listvotes,constseats,seats,divinterval=1,thresh=0,minpties=1,exempt=0,method="ams",deduct=True):
+    names = list(listvotes.keys())+[x for x in constseats.keys() if x not in listvotes]
+    votes = {x: listvotes.get(x,0) for x in names}
+    totvote = sum(votes.values())
+    top = sorted(names,key=lambda l:-votes[l])[:minpties]
+    eligible = {x: votes[x] for x in names if votes[x] > 0 and (votes[x]*100. >= thresh*totvote or x in top
+                                                                 or (exempt and constseats.get(x,0) >= exempt))}
+    kept = {x: constseats.get(x,0) for x in names if x not in eligible}
+    prseats = dict(kept)
+    house = seats-sum(kept.values()) if deduct else seats
+    if method == "ams":
+        prseats.update(hiavg(eligible,house,divinterval,bisect=True,
+                             floor={x: constseats.get(x,0) for x in eligible}))
+        return prseats
+    prop = None
+    if method == "level" and divinterval > 0:
+        # every average above the last constituency seat of the party needing most levelling has to be given,
+        # as well as those equal to it of the parties up to that party (which come first in ties)
+        d = fractions.Fraction(divinterval)
+        exact = {x: fractions.Fraction(v) for x, v in eligible.items()}
+        crit = {x: exact[x]/(1+d*(constseats[x]-1)) for x in eligible if constseats.get(x,0) > 0}
+        if crit:
+            lim = min(crit.values())
+            last = [x for x in crit if crit[x] == lim][-1]
+            before = True
+            level = {}
+            for x, v in exact.items():
+                steps = (v/lim-1)/d # the party's averages at least /lim/ are those of 0 to /steps/ seats held
+                n = math.floor(steps)+1 if steps >= 0 else 0
+                level[x] = n-(not before and n > 0 and steps == n-1)
+                before = before and x != last
+            if sum(level.values()) >= house:
+                house = sum(level.values())
+                prop = level
+    if prop is None:
+        prop = hiavg(eligible,house,divinterval,bisect=True) if house > 0 else {x: 0 for x in eligible}
+    prseats.update({x: max(prop[x],constseats.get(x,0)) for x in eligible})
+    return prseats
+
+# Codes ballots for bulk addition (see Election.addBallots), returning the candidates,
+# the rankings as indices into them (padded with -1) and the vote count of each ranking
+def codeballots(rankings,counts=1,cands=None):
+    if isinstance(rankings,BallotMatrix):
+        return rankings.cands, rankings.rankings, rankings.weights
+    if cands is not None:
+        codes = np.asarray(rankings)
+        codes = codes.reshape(len(codes),-1)
+    else:
+        try:
+            names = np.array(rankings)
+        except ValueError: # rankings of different lengths
+            names = None
+        if names is not None and names.ndim == 2 and names.dtype.kind in "US":
+            cands, codes = np.unique(names,return_inverse=True)
+            cands = cands.tolist()
+            codes = codes.reshape(names.shape)
+            if "" in cands: # padding
+                pad = cands.index("")
+                codes = np.where(codes==pad,-1,codes-(codes>pad))
+                del cands[pad]
+        else:
+            index = {}
+            cands = []
+            rows = [[c for c in r if c is not None and c != ""] for r in rankings]
+            depth = max([len(r) for r in rows]+[0])
+            codes = np.full((len(rows),depth),-1,dtype=np.int64)
+            for i, r in enumerate(rows):
+                for j, c in enumerate(r):
+                    if c not in index:
+                        index[c] = len(cands)
+                        cands.append(c)
+                    codes[i,j] = index[c]
+    counts = np.array(np.broadcast_to(counts,(len(codes),)))
+    return list(cands), codes, counts
+
 # A generic version of the SuperElection listPR function that can be used for any party-vote dictionary.
 def listPR(stat,seats,*args):
     prseats = {x: 0 for x in stat.keys()}
-    filledseats = 0
     if "lr" in args or "lrd" in args:
         quota = sum(stat.values())*1./seats
         if "lrd" in args:
@@ -557,27 +915,14 @@ def listPR(stat,seats,*args):
         for x in remseats :
             prseats[x[0]] += 1
     elif "hh" in args:
-        prseats = {x: 1 for x in stat.keys()}
-        filledseats = len(stat)
-        runningvotes = dict(stat.items())
-        while filledseats < seats :
-            pick = max(runningvotes.items(),key=lambda l:l[1])[0]
-            runningvotes[pick] = runningvotes[pick]*math.sqrt(prseats[pick]*(prseats[pick]+1))/\
-                                    math.sqrt((prseats[pick]+1)*(prseats[pick]+2))
-            prseats[pick] += 1
-            filledseats += 1
+        prseats = hiavg(stat,seats,hh=True,bisect="bisect" in args)
     else:
         divinterval = 1
         if len(args) > 0:
             numargs = [x for x in list(args) if isinstance(x, numbers.Number)]
             if len(numargs)>0:
                 divinterval = numargs[0]
-        runningvotes = dict(stat.items())
-        while filledseats < seats :
-            pick = max(runningvotes.items(),key=lambda l:l[1])[0]
-            runningvotes[pick] = runningvotes[pick]*(1.+divinterval*prseats[pick])/(1.+divinterval*(prseats[pick]+1))
-            prseats[pick] += 1
-            filledseats += 1
+        prseats = hiavg(stat,seats,divinterval,bisect="bisect" in args)
     if "s" in args :
         vpcts = percentages(stat)
         spcts = percentages(prseats)
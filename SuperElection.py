@@ -1,4 +1,5 @@
 import random
+import concurrent.futures
 from collections import Counter
 from Election import *
 
@@ -11,6 +12,9 @@ class SuperElection(Election) :
     def __init__(self,name="") :
         Election.__init__(self,name)
         self.subelections = []
+        self._subvotes = None
+        self._subseats = None
+        self._imported = None
 
     def __getitem__(self,idx) :
         if type(idx) is int:
@@ -64,12 +68,24 @@ class SuperElection(Election) :
                 self.sub(s).numSubs(*([spsub[s]]+list(args)))
         
 
+    # makes the sub-elections n empty ones: existing sub-elections are cleared of votes and seats and reused
+    # if there are n of them (of the right type), otherwise they are replaced by n new ones
+    def resetSubs(self,n,*args) :
+        subtype = SuperElection if "super" in args else Election
+        if len(self.subelections) != n or any(type(sub) is not subtype for sub in self.subelections):
+            self.numSubs(n,*args)
+            return
+        for sub in self.subelections :
+            sub.clearVotes()
+            sub.clearSeats()
+            sub.positions = self.positions
+
     def clearSubs(self):
         del self.subelections[:]
 
     def clearEverything(self):
         super(SuperElection, self).clearEverything()
-        clearSubs()
+        self.clearSubs()
 
     def sub(self,i):
         return self.subelections[i]
@@ -77,33 +93,72 @@ class SuperElection(Election) :
     def randsub(self):
         return random.choice(self.subelections)
 
-    # the combined votes in all sub-elections 
+    # adds votes in bulk (see Election.addBallots), routing each ranking to the sub-election with the index
+    # (or name) given in /districts/, all in one pass. If /own/ is set, the votes are also added to the SuperElection itself.
+    def addBallots(self,rankings,counts=1,districts=None,cands=None,own=True):
+        cands, codes, counts = codeballots(rankings,counts,cands)
+        if own or districts is None:
+            self.addRankings(cands,codes,counts)
+        if districts is None:
+            return
+        districts = np.asarray(districts)
+        if districts.dtype.kind not in "iu":
+            subidx = {el.name: i for i, el in enumerate(self.subelections)}
+            districts = np.array([subidx[d] for d in districts.tolist()])
+        order = np.argsort(districts,kind="stable")
+        starts = np.searchsorted(districts[order],np.arange(len(self.subelections)+1))
+        for i, sub in enumerate(self.subelections):
+            if starts[i] < starts[i+1]:
+                rows = order[starts[i]:starts[i+1]]
+                sub.addRankings(cands,codes[rows],counts[rows])
+
+    # adds votes in bulk from an iterable of (ranking, count, district) rows, /chunksize/ of them at a time
+    def addBallotRows(self,rows,chunksize=100000,cands=None,own=True):
+        rows = iter(rows)
+        chunk = list(itertools.islice(rows,chunksize))
+        while chunk:
+            self.addBallots([r[0] for r in chunk],np.array([r[1] for r in chunk]),[r[2] for r in chunk],cands,own)
+            chunk = list(itertools.islice(rows,chunksize))
+
+    # The combined votes in all sub-elections, as a BallotMatrix and a first preference Counter.
+    # The ballots of all sub-elections are merged with one aggregation, and the result is kept
+    # until the votes of one of the sub-elections change.
+    def mergeSubVotes(self) :
+        key = tuple(sub._votestamp for sub in self.subelections)
+        if self._subvotes is None or self._subvotes[0] != key:
+            subfirstprefs = Counter()
+            for sub in self.subelections :
+                subfirstprefs.update(sub.firstprefs)
+            self._subvotes = (key,BallotMatrix.merge([sub.ballots() for sub in self.subelections]),+subfirstprefs)
+        return self._subvotes[1:]
+
+    # the combined votes in all sub-elections (as Counters)
     def getSubVotes(self) :
-        subvotetotals = Counter()
-        subfirstprefs = Counter()
-        for sub in self.subelections :
-            subvotetotals += Counter(sub.votetotals)
-            subfirstprefs += Counter(sub.firstprefs)
-        return (dict(subvotetotals),dict(subfirstprefs))
+        bm, subfirstprefs = self.mergeSubVotes()
+        return (bm.toCounter(),Counter(subfirstprefs))
 
-    # the combined seat results in all sub-elections
+    # the combined seat results in all sub-elections (kept until the seats of one of them change)
     def getSubSeats(self) :
-        subseattotals = Counter()
-        for sub in self.subelections :
-            subseattotals += Counter(sub.seattotals)
-        return subseattotals
+        key = tuple(sub._seatstamp for sub in self.subelections)
+        if self._subseats is None or self._subseats[0] != key:
+            subseattotals = Counter()
+            for sub in self.subelections :
+                subseattotals.update(sub.seattotals)
+            self._subseats = (key,+subseattotals)
+        return Counter(self._subseats[1])
 
     # assigned the combined votes in all sub-elections as the votes for the SuperElection as a whole
+    # (nothing to do if neither they nor the votes of the SuperElection have changed since the last import)
     def importSubVotes(self) :
-        self.votetotals.clear()
-        self.firstprefs.clear()
-        subvfp = self.getSubVotes()
-        self.votetotals = subvfp[0]
-        self.firstprefs = subvfp[1]
+        bm, subfirstprefs = self.mergeSubVotes()
+        if self._imported == (self._subvotes[0],self._votestamp):
+            return
+        self.setBallots(BallotMatrix(bm.cands,bm.rankings,bm.weights))
+        self.firstprefs = Counter(subfirstprefs)
+        self._imported = (self._subvotes[0],self._votestamp)
 
     # same as above, but for seats
     def importSubSeats(self) :
-        self.seattotals.clear()
         self.seattotals = self.getSubSeats()
 
     # calculates the seat distribution between sub-elections based on the numbers of votes in them, using the listPR parameters given
@@ -124,14 +179,16 @@ class SuperElection(Election) :
         '''
         for sub in self.subelections :
             sub.clearEverything()
-        vpersub = {x: self.totVote()/len(self.subelections) for x in range(len(self.subelections))}
+        totvote = self.totVote()
+        vpersub = {x: totvote/len(self.subelections) for x in range(len(self.subelections))}
         if not (minsize<0 or maxsize<0 or maxsize<minsize) :
             if absorpct == "pct" :
-                vpersub = {x: int(self.totVote()*random.uniform(minsize,maxsize)/100.) for x in range(len(self.subelections))}
+                vpersub = {x: int(totvote*random.uniform(minsize,maxsize)/100.) for x in range(len(self.subelections))}
             else :
                 vpersub = {x: random.randint(minsize,maxsize) for x in range(len(self.subelections))}
-            if sum(vpersub.values()) > self.totVote():
-                    vpersub = {x: int(self.totVote()*1./sum(vpersub.values())*vpersub[x]) for x in vpersub.keys()}
+            totsize = sum(vpersub.values())
+            if totsize > totvote:
+                    vpersub = {x: int(totvote*1./totsize*vpersub[x]) for x in vpersub.keys()}
         nonfullsubs = list(range(len(self.subelections)))
         for v in self.votetotals.keys() :
             remvs = self.votetotals[v]
@@ -153,19 +210,71 @@ class SuperElection(Election) :
                 if  psub.totVote() == vpersub[pick] and len(nonfullsubs)>0:
                     nonfullsubs.remove(pick)
 
+    # spreads the votes of the SuperElection among the subelections randomly, like randomSpreadVotes but
+    # with all the votes cast with each ranking split between subelections in a single draw
+    def drawSpreadVotes(self,minsize=-1,maxsize=-1,absorpct="abs",method="hypergeometric",rng=None) :
+        '''Parameters:
+        minsize/maxsize: minimum/maximum size of subelections, by absolute number of votes if absorpct is set to "abs",
+                         or by percentage of all votes if it is set to "pct". Subelections are of equal size (as far as possible)
+                         if these are not given. Votes left over when all subelections are full are spread uniformly.
+        method: "hypergeometric": the subelections are filled to exactly their drawn sizes, as if the voters were shuffled
+                                  and dealt out to them (multivariate hypergeometric draws)
+                "multinomial": each vote goes to a subelection independently, with probabilities proportional to
+                               the drawn sizes, so that these are only met on average
+        rng: numpy random Generator (by default, one seeded from the random module)
+        '''
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+        nsubs = len(self.subelections)
+        bm = self.ballots()
+        counts = np.round(bm.weights).astype(np.int64)
+        totvote = counts.sum().item()
+        if not (minsize<0 or maxsize<0 or maxsize<minsize) :
+            if absorpct == "pct" :
+                sizes = (totvote*rng.uniform(minsize,maxsize,nsubs)/100.).astype(np.int64)
+            else :
+                sizes = rng.integers(minsize,maxsize,nsubs,endpoint=True)
+            if sizes.sum() > totvote:
+                sizes = (totvote*1./sizes.sum()*sizes).astype(np.int64)
+        else :
+            sizes = np.full(nsubs,totvote//nsubs,dtype=np.int64)
+            sizes[rng.choice(nsubs,totvote-sizes.sum(),replace=False)] += 1
+        sizes += rng.multinomial(totvote-sizes.sum(),np.full(nsubs,1./nsubs))
+        # (ranking x subelection) table of votes
+        table = np.zeros((len(counts),nsubs),dtype=np.int64)
+        if method == "multinomial":
+            p = sizes/max(sizes.sum(),1)
+            for i, n in enumerate(counts.tolist()):
+                table[i] = rng.multinomial(n,p)
+        else:
+            left = sizes.copy()
+            for i, n in enumerate(counts.tolist()):
+                table[i] = rng.multivariate_hypergeometric(left,n)
+                left -= table[i]
+        for d, sub in enumerate(self.subelections):
+            rows = np.nonzero(table[:,d])[0]
+            sub.clearSeats()
+            sub.setBallots(BallotMatrix(bm.cands,bm.rankings[rows],table[rows,d]))
+
     # repeats the process above for each subelection (that has subelections of its own)
     def subRandomSpreadVotes(self,*args) :
         for s in self.subelections :
             s.randomSpreadVotes(*args)
 
     # runs runElection in all sub-elections according to the electoral system and parameters specified in args 
-    def runSubElections(self,*args) :
+    def runSubElections(self,*args,**kwargs) :
         '''Args:
         first argument : electoral system, i.e. the name of the function implementing it, i.e. "FPTP" for first past the post, "IRV" for instant runoff voting etc.
         subsequent arguments: parameters of the electoral system (mainly used for listPR/IRVlistPR), which are passed on to the function implementing the electoral system,
                               as well as the following parameters for seat distribution among subelections:  
                               "eq" : Equal (as far as possible) distribution of sub-subs among subs
                               "hhdist" : Huntington-Hill distribution
+
+        Keyword args:
+        "procs": number of worker processes to run the sub-elections in (in one process, one after another, by default).
+                 Each sub-election's ballots are shipped to the workers as integer-coded arrays, and only its seat results come back.
+        "seed": seed for the random tie-breaks. Each sub-election gets its own seed derived from it, so the results are the
+                same however many processes are used. Without a seed, the parallel mode derives one from the random module.
         '''
         if "pop" in args :
             spsub = {}
@@ -173,16 +282,32 @@ class SuperElection(Election) :
                 spsub = self.seatsPerSub([x for x in args if type(x) is int][0],"hh")
             else :
                 spsub = self.seatsPerSub([x for x in args if type(x) is int][0],"lr")
-            for s in range(len(self.subelections)) :
-                self.sub(s).runElection(*(list(args)+[spsub[s]]))
+            subargs = [list(args)+[spsub[s]] for s in range(len(self.subelections))]
         elif "eq" in args :
             seats = [x for x in args if type(x) is int][0]
             spsub = {x:seats/len(self.subelections) for x in range(len(self.subelections))}
-            for s in range(len(self.subelections)) :
-                self.sub(s).runElection(*(list(args)+[spsub[s]]))
+            subargs = [list(args)+[spsub[s]] for s in range(len(self.subelections))]
         else:
-            for sub in self.subelections :
-                sub.runElection(*args)
+            subargs = [list(args)]*len(self.subelections)
+        procs = kwargs.get("procs")
+        seed = kwargs.get("seed")
+        if procs and seed is None:
+            seed = random.getrandbits(64)
+        if seed is None:
+            for sub, sargs in zip(self.subelections,subargs):
+                sub.runElection(*sargs)
+            return
+        seeds = [s.generate_state(1,np.uint64)[0].item() for s in np.random.SeedSequence(seed).spawn(len(self.subelections))]
+        jobs = [(BallotMatrix(sub.ballots().cands,sub.ballots().rankings,sub.ballots().weights),sub.name,sargs,dseed) for sub, sargs, dseed in zip(self.subelections,subargs,seeds)]
+        if procs:
+            with concurrent.futures.ProcessPoolExecutor(procs) as pool:
+                results = list(pool.map(runpacked,jobs,chunksize=max(1,len(jobs)//(4*procs))))
+        else:
+            state = random.getstate()
+            results = [runpacked(job) for job in jobs]
+            random.setstate(state)
+        for sub, res in zip(self.subelections,results):
+            sub.seattotals = Counter(res)
 
     # Simulates a multi-district general election (given that the votes have been added), takes the same arguments as runSubElections, plus "fins" and "stot" as options
     def runGenElection(self,*args,**kwargs) :
@@ -192,8 +317,9 @@ class SuperElection(Election) :
         
         Keyword args:
         "al": tuple of args indicating the electoral system for an at-large election
+        "procs", "seed": parallel and seeded running of the sub-elections (see runSubElections)
         '''
-        self.runSubElections(*args)
+        self.runSubElections(*args,**{k: kwargs[k] for k in ("procs","seed") if k in kwargs})
         self.importSubSeats()
         if "al" in kwargs:
             self.runElection(*kwargs["al"],supp=1)
@@ -205,3 +331,13 @@ class SuperElection(Election) :
             print(valsorted({x[0]: round(x[1],2) for x in percentages(self.seattotals).items()}))
         if "stot" in args :
             return self.seattotals
+
+# Runs an election on integer-coded ballots, given as a (BallotMatrix, name, runElection args, seed) job,
+# and returns its seat results. Used to run sub-elections in worker processes (see SuperElection.runSubElections).
+def runpacked(job):
+    bm, name, args, seed = job
+    el = Election(name)
+    el.setBallots(bm)
+    random.seed(seed)
+    el.runElection(*args)
+    return dict(el.seattotals)
@@ -0,0 +1,511 @@
+import os
+import random
+from collections.abc import Sequence
+import numpy as np
+from Election import *
+from BallotMatrix import codetype
+from districts import keyorder, spatial
+
+class VoterPopulation(Sequence):
+    """Simulates a large population of voters (see Voter) stored as arrays rather than as individual objects.
+    All voters vote at once: their rankings are computed with one vectorised distance calculation and sort,
+    and added to each election as aggregated ballots.
+
+    Attributes:
+        positions: N x 2 array of the political compass (economic, social) positions of the voters
+                   (default: random following a normal distribution, as for Voter)
+        regs: elections in which every voter is registered to vote
+        superel: SuperElection whose sub-elections (districts) the voters are registered in
+        district: index of the sub-election of /superel/ each voter is registered in (-1 for none)
+        coords: N x 2 array of the geographic coordinates of the voters, if they have any (see districts.places)
+        chunksize: number of voters processed at a time
+    """
+    def __init__(self,n=0,regs=[],positions=None):
+        if positions is None:
+            positions = np.column_stack((np.random.normal(0,0.5,n),np.random.normal(0,1,n)))
+        self.positions = np.asarray(positions,dtype=float)
+        self.regs = list(regs)
+        self.superel = None
+        self.district = np.full(len(self.positions),-1,dtype=np.int32)
+        self.chunksize = 2**18
+        self.evenregged = None
+        self.coords = None
+
+    # builds a population from a list of Voters (registrations in sub-elections of /superel/ are kept as districts)
+    @classmethod
+    def fromVoters(cls,vtrlist,superel=None):
+        pop = cls(positions=[v.position for v in vtrlist])
+        if superel:
+            pop.superel = superel
+            subidx = {id(s): i for i, s in enumerate(superel.subelections)}
+            pop.district = np.array([next((subidx[id(r)] for r in v.regs if id(r) in subidx),-1) for v in vtrlist],dtype=np.int32)
+        return pop
+
+    def __len__(self):
+        return len(self.positions)
+
+    # Voter-like views of single voters, e.g. for random.sample
+    def __getitem__(self,idx):
+        if isinstance(idx,slice):
+            return [PopulationVoter(self,i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("voter index out of range")
+        return PopulationVoter(self,idx)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield PopulationVoter(self,i)
+
+    # registers all voters in each election given as an argument
+    def reg(self,*regs):
+        self.regs += list(regs)
+
+    # de-registers all voters in each election given as an argument
+    def dereg(self,*regs):
+        for r in regs:
+            self.regs.remove(r)
+
+    # replaces the registrations of the voters: all of them in /superel/, and each in the sub-election given by /district/
+    def newreg(self,superel,district=None):
+        self.regs = [superel]
+        self.superel = superel
+        if district is None:
+            district = np.full(len(self),-1)
+        self.district = np.asarray(district,dtype=np.int32)
+        self.evenregged = None
+
+    # registers all voters in /superel/, and in /nsub/ of its sub-elections as contiguous, equally sized groups.
+    # The districts are only reassigned if /nsub/ or the voters (their number or order) have changed since the last call.
+    def evenreg(self,superel,nsub):
+        self.regs = [superel]
+        self.superel = superel
+        if self.evenregged == (nsub,len(self)):
+            return
+        for chunk in self.chunks():
+            self.district[chunk] = np.arange(chunk.start,chunk.stop,dtype=np.int64)*nsub//len(self)
+        self.evenregged = (nsub,len(self))
+
+    # registers all voters in /superel/, and in /nsub/ of its sub-elections as compact geographic districts of equal
+    # population formed from the voters' coordinates (see districts.spatial, which is given /opts/).
+    # As with evenreg, the districts are only rebuilt if /nsub/ or the voters have changed since the last call.
+    def spatialreg(self,superel,nsub,**opts):
+        if self.coords is None:
+            raise ValueError("the voters have no coordinates (see districts.places)")
+        self.regs = [superel]
+        self.superel = superel
+        key = ("spatial",nsub,len(self),id(self.coords))
+        if self.evenregged == key:
+            return
+        district = spatial(self.coords,nsub,**opts)
+        for chunk in self.chunks():
+            self.district[chunk] = district[chunk]
+        self.evenregged = key
+
+    # called whenever the voters' positions change
+    def moved(self):
+        pass
+
+    # One step of opinion dynamics for all voters at once, chunk by chunk (see driftmean for the parameters).
+    # The plurality winners of the elections the voters are registered in are found once for the whole step.
+    # If /partyel/ and /flexes/ are given, the parties of /partyel/ first follow the voters (see followmean).
+    def drift(self,shift=(0.,0.),std=(0.1,0.05),ruling=None,rulepull=0.,meanpull=0.,centre=(0.,0.),centrepull=0.,shun=0.,
+              partyel=None,flexes=None):
+        mean = self.meanpos() if meanpull or flexes else None
+        if partyel is not None and flexes:
+            followmean(partyel,mean,flexes)
+        if shun:
+            common = [winnerpos(el) for el in self.regs]
+            common = [w for w in common if w is not None]
+            subs = self.superel.subelections if self.superel is not None else []
+            subwins = np.array([winnerpos(sub) or (np.nan,np.nan) for sub in subs]+[(np.nan,np.nan)],dtype=float).reshape(-1,2)
+        for chunk in self.chunks():
+            vpos = self.positions[chunk]
+            shunned = None
+            if shun: # mean position of the winners in the elections of each voter
+                own = subwins[self.district[chunk]] # district -1 picks the last row, with no winner
+                has = ~np.isnan(own[:,0])
+                total = np.sum(common,axis=0) + np.where(has[:,None],own,0.)
+                shunned = total/np.maximum(len(common)+has,1)[:,None]
+            self.positions[chunk] = np.random.normal(driftmean(vpos,shift,ruling,rulepull,mean,meanpull,centre,centrepull,shunned,shun),std)
+        self.moved()
+
+    # the mean (economic, social) position of the voters
+    def meanpos(self):
+        tot = np.zeros(2)
+        for chunk in self.chunks():
+            tot += self.positions[chunk].sum(0)
+        return tuple((tot/len(self)).tolist())
+
+    # reorders the voters by a sort key (one number per voter), e.g. to form geographically coherent districts.
+    # Returns the order (the former index of each voter).
+    def sort(self,key):
+        order = keyorder(key)
+        self.positions = self.positions[order]
+        self.district = self.district[order]
+        if self.coords is not None:
+            self.coords = self.coords[order]
+        self.evenregged = None
+        self.moved()
+        return order
+
+    # the rankings (indices of the parties in /cands/, nearest first) of the voters in /idx/ (a slice or an index array),
+    # given a {party: position} dictionary. Equally distant parties are ranked in dictionary order, as by Voter.vote.
+    def rankings(self,partypos,idx=slice(None)):
+        cands = list(partypos.keys())
+        ppos = np.array([partypos[c] for c in cands],dtype=float).reshape(-1,2)
+        vpos = self.positions[idx]
+        dists = (vpos[:,0:1]-ppos[:,0])**2 + (vpos[:,1:2]-ppos[:,1])**2
+        return cands, np.argsort(dists,axis=1,kind="stable").astype(codetype(len(cands)))
+
+    # indices of a random sample of /n/ voters (sorted, without replacement), stratified by district if /bydistrict/ is set
+    # (each district sampled in proportion to its number of voters, by the largest remainder method).
+    # The stratified sample is drawn as ranks of voters within their districts and picked out chunk by chunk,
+    # so it only needs memory for the sample and the district sizes.
+    def sample(self,n,bydistrict=False,rng=None):
+        if rng is None:
+            rng = np.random.default_rng(np.random.randint(2**32))
+        if not bydistrict:
+            return np.sort(rng.choice(len(self),n,replace=False))
+        sizes = np.zeros(1,dtype=np.int64) # voters in each district, from -1 (unregistered) up
+        for chunk in self.chunks():
+            counts = np.bincount(self.district[chunk]+1)
+            sizes = np.pad(sizes,(0,max(0,len(counts)-len(sizes))))
+            sizes[:len(counts)] += counts
+        dists = np.flatnonzero(sizes)
+        alloc = listPR(dict(enumerate(sizes[dists].tolist())),n,"lr")
+        starts = np.cumsum(sizes)-sizes # voters in the districts before each one
+        picked = np.sort(np.concatenate([starts[d]+rng.choice(sizes[d],alloc[i],replace=False)
+                                         for i, d in enumerate(dists.tolist())]+[np.zeros(0,dtype=np.int64)]))
+        seen = starts.copy()
+        found = []
+        for chunk in self.chunks():
+            codes = self.district[chunk]+1
+            order = np.argsort(codes,kind="stable")
+            first = np.searchsorted(codes[order],codes[order])
+            rank = np.empty(len(codes),dtype=np.int64)
+            rank[order] = seen[codes[order]]+np.arange(len(codes))-first
+            seen += np.bincount(codes,minlength=len(seen))
+            hit = np.searchsorted(picked,rank)
+            found.append(chunk.start+np.flatnonzero(picked[np.minimum(hit,len(picked)-1)] == rank) if len(picked) else [])
+        return np.concatenate(found+[np.zeros(0,dtype=np.int64)]).astype(np.int64)
+
+    # first preference votes of the voters in /idx/ (a slice or an index array) for each of several sets of party positions,
+    # all computed at once: /positionsets/ is an (S x k x 2) array of the positions of k parties in each set (or a k x 2 array
+    # for a single set), and the result an (S x k) array of numbers of votes. Equally distant parties go to the first one, as in Voter.vote.
+    def firstprefs(self,positionsets,idx=slice(None)):
+        ps = np.asarray(positionsets,dtype=float)
+        single = ps.ndim == 2
+        ps = ps.reshape(-1,ps.shape[-2],2)
+        nsets, k = ps.shape[:2]
+        counts = np.zeros(nsets*k,dtype=np.int64)
+        for vpos in self.blocks(idx,nsets*k):
+            dists = (vpos[None,:,None,0]-ps[:,None,:,0])**2 + (vpos[None,:,None,1]-ps[:,None,:,1])**2
+            top = dists.argmin(2) + np.arange(nsets)[:,None]*k
+            counts += np.bincount(top.ravel(),minlength=nsets*k)
+        counts = counts.reshape(nsets,k)
+        return counts[0] if single else counts
+
+    # first preference votes party /i/ of the parties at the (k x 2) positions /ppos/ would get at each of the positions /tries/,
+    # the other parties staying where they are: each voter votes for a try if it is nearer than the voter's nearest other party
+    # (or as near, and party i comes first), so only one distance per voter and try is computed
+    def trialvotes(self,ppos,i,tries,idx=slice(None)):
+        ppos = np.asarray(ppos,dtype=float)
+        tries = np.asarray(tries,dtype=float).reshape(-1,2)
+        others = np.delete(np.arange(len(ppos)),i)
+        counts = np.zeros(len(tries),dtype=np.int64)
+        for vpos in self.blocks(idx,len(tries)):
+            if len(others):
+                odists = (vpos[:,0:1]-ppos[others,0])**2 + (vpos[:,1:2]-ppos[others,1])**2
+                nearest = odists.argmin(1)
+                onear = odists[np.arange(len(vpos)),nearest]
+                ahead = others[nearest] > i # party i wins ties with this one
+            else:
+                onear = np.full(len(vpos),np.inf)
+                ahead = np.ones(len(vpos),dtype=bool)
+            tdists = (vpos[:,0:1]-tries[:,0])**2 + (vpos[:,1:2]-tries[:,1])**2
+            counts += ((tdists < onear[:,None]) | ((tdists == onear[:,None]) & ahead[:,None])).sum(0)
+        return counts
+
+    # the positions of the voters in /idx/ (a slice or an index array), in blocks small enough
+    # to compute /width/ distances for each voter at once
+    def blocks(self,idx,width=1):
+        if isinstance(idx,slice):
+            idx = range(*idx.indices(len(self)))
+        step = max(1,self.chunksize*4//width)
+        for lo in range(0,len(idx),step):
+            block = idx[lo:lo+step]
+            yield self.positions[slice(block.start,block.stop) if isinstance(block,range) else block]
+
+    # An opinion poll of a random sample of /samplesize/ voters (stratified by district if /bydistrict/ is set)
+    # on each of several sets of party positions (see firstprefs), all asked of the same sample.
+    # Returns the first preference percentages of the parties in each set.
+    def poll(self,positionsets,samplesize=500,bydistrict=False):
+        sample = self.sample(min(samplesize,len(self)),bydistrict)
+        return self.firstprefs(positionsets,sample)*100./len(sample)
+
+    # the ranges of voter indices processed at a time
+    def chunks(self):
+        for lo in range(0,len(self),self.chunksize):
+            yield slice(lo,min(lo+self.chunksize,len(self)))
+
+    # adds the votes of all voters to every election they are registered in (default), or to the elections given
+    def vote(self,*elections):
+        targets = list(elections) if elections else list(self.regs)
+        subs = self.superel.subelections if not elections and self.superel is not None else []
+        # voters' rankings depend only on the party positions, so they are counted once per positions dictionary
+        posdicts = {id(el.positions): el.positions for el in targets+subs}
+        for pid, partypos in posdicts.items():
+            if not partypos:
+                continue
+            cands, dists, rankings, counts = self.tally(partypos,bool(subs))
+            for el in targets:
+                if id(el.positions) == pid:
+                    el.addRankings(cands,rankings,counts)
+            starts = np.searchsorted(dists,np.arange(len(subs)+1))
+            for d, sub in enumerate(subs):
+                if id(sub.positions) == pid and starts[d] < starts[d+1]:
+                    sub.addRankings(cands,rankings[starts[d]:starts[d+1]],counts[starts[d]:starts[d+1]])
+
+    # the distinct rankings cast (within each district if /bydistrict/ is set, otherwise district -1),
+    # and the numbers of voters casting them, sorted by district
+    def tally(self,partypos,bydistrict=False):
+        cands = list(partypos.keys())
+        k = len(cands)
+        ndist = len(self.superel.subelections) if bydistrict else 0
+        packed = k**k*(ndist+2) < 2**62
+        keys, counts = [], []
+        for chunk in self.chunks():
+            rk = self.rankings(partypos,chunk)[1]
+            dist = self.district[chunk] if bydistrict else np.full(len(rk),-1)
+            if packed: # the district and ranking of each voter as one integer: (district+1)*k**k + ranking digits in base k
+                ck = dist.astype(np.int64)+1
+                for j in range(k):
+                    ck = ck*k + rk[:,j]
+                ukeys, ucounts = np.unique(ck,return_counts=True)
+            else:
+                ukeys, ucounts = np.unique(np.column_stack((dist,rk)),axis=0,return_counts=True)
+            keys.append(ukeys)
+            counts.append(ucounts)
+        if not keys:
+            return cands, np.zeros(0,dtype=np.int64), np.zeros((0,k),dtype=codetype(k)), np.zeros(0,dtype=np.int64)
+        ukeys, inv = np.unique(np.concatenate(keys),axis=0,return_inverse=True)
+        ucounts = np.bincount(inv.ravel(),np.concatenate(counts),minlength=len(ukeys)).round().astype(np.int64)
+        if packed:
+            rk = np.zeros((len(ukeys),k),dtype=codetype(k))
+            for j in range(k-1,-1,-1):
+                ukeys, rk[:,j] = np.divmod(ukeys,k)
+            return cands, ukeys-1, rk, ucounts
+        return cands, ukeys[:,0], ukeys[:,1:].astype(codetype(k)), ucounts
+
+
+# The expected new positions of voters at the (N x 2) positions /vpos/ after one step of opinion dynamics: each voter moves by
+#   shift + rulepull*(voter - ruling) + meanpull*(mean + shift - voter) + centrepull*(centre - voter) - shun*shunned
+# where /ruling/ is a position voters move away from (e.g. the centroid of the ruling coalition), /mean/ the mean position
+# of the voters, and /shunned/ the (N x 2) mean positions of the plurality winners of the elections of each voter.
+def driftmean(vpos,shift=(0.,0.),ruling=None,rulepull=0.,mean=None,meanpull=0.,centre=(0.,0.),centrepull=0.,shunned=None,shun=0.):
+    vmean = vpos + shift
+    if ruling is not None and rulepull:
+        vmean = vmean + rulepull*(vpos-np.asarray(ruling))
+    if mean is not None and meanpull:
+        vmean = vmean + meanpull*(np.asarray(mean)+shift-vpos)
+    if centrepull:
+        vmean = vmean + centrepull*(np.asarray(centre)-vpos)
+    if shunned is not None and shun:
+        vmean = vmean - shun*shunned
+    return vmean
+
+# moves the parties of /el/ towards the /mean/ position of the voters, by the share flexes[party] (economic, social)
+# of the distance, give or take 10%
+def followmean(el,mean,flexes):
+    for p, ppos in el.positions.items():
+        el.positions[p] = tuple((np.array(ppos)+(np.array(mean)-ppos)*np.array(flexes[p])*np.random.normal(1,0.1,2)).tolist())
+
+# the position of the plurality winner of an election (None if it has no votes)
+def winnerpos(el):
+    if not el.firstprefs:
+        return None
+    return tuple(el.positions[el.plurality()[0]])
+
+
+class PopulationVoter(Voter):
+    """A view of a single voter of a VoterPopulation, offering the Voter interface.
+    Registrations made through the view in elections other than those of the population are kept by the view itself.
+    """
+    def __init__(self,pop,i):
+        self.pop = pop
+        self.i = i
+        self.name = ""
+        self.extraregs = []
+
+    @property
+    def position(self):
+        return tuple(self.pop.positions[self.i].tolist())
+
+    @position.setter
+    def position(self,pos):
+        self.pop.positions[self.i] = pos
+        self.pop.moved()
+
+    @property
+    def regs(self):
+        regs = list(self.pop.regs)
+        if self.pop.superel is not None and self.pop.district[self.i] >= 0:
+            regs.append(self.pop.superel.sub(int(self.pop.district[self.i])))
+        return regs + self.extraregs
+
+    @regs.setter
+    def regs(self,regs):
+        self.extraregs = []
+        subs = self.pop.superel.subelections if self.pop.superel is not None else []
+        district = -1
+        for r in regs:
+            if any(r is s for s in subs):
+                district = next(i for i, s in enumerate(subs) if r is s)
+            elif not any(r is p for p in self.pop.regs):
+                self.extraregs.append(r)
+        if subs and self.pop.district[self.i] != district:
+            self.pop.district[self.i] = district
+            self.pop.evenregged = None
+
+    def dereg(self,*regs):
+        remaining = self.regs
+        for r in regs:
+            remaining.remove(r)
+        self.regs = remaining
+
+    # repositions the voter politically
+    def pos(self,econpos="rand",socpos="rand"):
+        if econpos == "rand":
+            econpos = random.gauss(0, 0.5)
+        if socpos == "rand":
+            socpos = random.gauss(0, 1)
+        self.position = (econpos, socpos)
+
+
+class MappedPopulation(VoterPopulation):
+    """A VoterPopulation kept out of core, in memory-mapped .npy files in the directory /path/, so that
+    national-scale electorates (up to around 10^8 voters) can be simulated with a constant amount of memory.
+    Voting and the other steps stream over the voters in chunks of /chunksize/; only sorting the voters (see sort)
+    needs memory for every voter, to hold the sort key and the order (16 bytes per voter).
+
+    Files: positions.npy (voter positions), district.npy (district indices),
+           optionally coords.npy (geographic coordinates of the voters, see VoterPopulation.spatialreg),
+           and rankings.npy with rankpos.npy (cached rankings and the party positions they were computed for)
+
+    Modes (as for numpy.memmap): "r+" to read and write the files, "r" to read only,
+    "c" to read them as a shared base and keep any changes in memory (copy-on-write)
+    """
+    def __init__(self,path,n=None,regs=[],mode="r+",chunksize=2**20):
+        self.path = path
+        self.mode = mode
+        self.chunksize = chunksize
+        self.regs = list(regs)
+        self.superel = None
+        self.evenregged = None
+        self.coords = None
+        if n is not None: # a new random electorate, generated chunk by chunk
+            os.makedirs(path,exist_ok=True)
+            positions = np.lib.format.open_memmap(self.file("positions"),mode="w+",dtype=float,shape=(n,2))
+            district = np.lib.format.open_memmap(self.file("district"),mode="w+",dtype=np.int32,shape=(n,))
+            for lo in range(0,n,chunksize):
+                hi = min(lo+chunksize,n)
+                positions[lo:hi] = np.column_stack((np.random.normal(0,0.5,hi-lo),np.random.normal(0,1,hi-lo)))
+                district[lo:hi] = -1
+            del positions, district
+        self.positions = np.load(self.file("positions"),mmap_mode=mode)
+        self.district = np.load(self.file("district"),mmap_mode=mode)
+        if os.path.exists(self.file("coords")):
+            self.coords = np.load(self.file("coords"),mmap_mode=mode)
+        self.loadRankings()
+
+    # saves an in-memory population as a new mapped population
+    @classmethod
+    def fromPopulation(cls,pop,path,mode="r+"):
+        os.makedirs(path,exist_ok=True)
+        np.save(os.path.join(path,"positions.npy"),pop.positions)
+        np.save(os.path.join(path,"district.npy"),pop.district.astype(np.int32))
+        if pop.coords is not None:
+            np.save(os.path.join(path,"coords.npy"),pop.coords)
+        mpop = cls(path,mode=mode,regs=pop.regs)
+        mpop.superel = pop.superel
+        return mpop
+
+    def file(self,name):
+        return os.path.join(self.path,name+".npy")
+
+    def flush(self):
+        for arr in (self.positions,self.district,self.coords):
+            if isinstance(arr,np.memmap):
+                arr.flush()
+
+    def newreg(self,superel,district=None):
+        self.regs = [superel]
+        self.superel = superel
+        for chunk in self.chunks():
+            self.district[chunk] = -1 if district is None else district[chunk]
+        self.evenregged = None
+
+    # reorders the voters by a sort key, writing the reordered positions, districts and coordinates chunk by chunk.
+    # Unlike the other steps, this needs the key and the order of all voters in memory (O(N), 16 bytes per voter)
+    def sort(self,key):
+        order = keyorder(key)
+        names = ["positions","district"]
+        if isinstance(self.coords,np.memmap):
+            names.append("coords")
+        elif self.coords is not None: # coordinates only held in memory
+            self.coords = self.coords[order]
+        for name in names:
+            old = getattr(self,name)
+            new = np.lib.format.open_memmap(self.file(name+".sorting"),mode="w+",dtype=old.dtype,shape=old.shape)
+            for chunk in self.chunks():
+                new[chunk] = old[order[chunk]]
+            new.flush()
+            del new, old
+            setattr(self,name,None)
+            os.replace(self.file(name+".sorting"),self.file(name))
+            setattr(self,name,np.load(self.file(name),mmap_mode=self.mode))
+        self.evenregged = None
+        self.moved()
+        return order
+
+    # computes and stores the rankings of all voters for a {party: position} dictionary,
+    # so that voting with the same party positions only needs to read them (until the voters move)
+    def cacheRankings(self,partypos):
+        cands = list(partypos.keys())
+        ranks = np.lib.format.open_memmap(self.file("rankings"),mode="w+",dtype=codetype(len(cands)),shape=(len(self),len(cands)))
+        for chunk in self.chunks():
+            ranks[chunk] = VoterPopulation.rankings(self,partypos,chunk)[1]
+        ranks.flush()
+        del ranks
+        np.save(self.file("rankpos"),np.array([partypos[c] for c in cands],dtype=float))
+        np.save(self.file("rankcands"),np.array(cands,dtype=str))
+        self.loadRankings()
+
+    def loadRankings(self):
+        self.rankcache = None
+        if all(os.path.exists(self.file(name)) for name in ("rankings","rankpos","rankcands")):
+            self.rankcache = (np.load(self.file("rankcands")).tolist(),np.load(self.file("rankpos")),
+                              np.load(self.file("rankings"),mmap_mode="r"))
+
+    def dropRankings(self):
+        self.rankcache = None
+        for name in ("rankings","rankpos","rankcands"):
+            if os.path.exists(self.file(name)):
+                os.remove(self.file(name))
+
+    # called whenever the voters' positions change, which invalidates the cached rankings
+    # (also on disk, unless the files are shared read-only or copy-on-write)
+    def moved(self):
+        if self.rankcache is not None:
+            self.rankcache = None
+            if self.mode == "r+":
+                self.dropRankings()
+
+    def rankings(self,partypos,idx=slice(None)):
+        cands = list(partypos.keys())
+        if self.rankcache and self.rankcache[0] == cands and \
+                np.array_equal(self.rankcache[1],np.array([partypos[c] for c in cands],dtype=float)):
+            return cands, np.asarray(self.rankcache[2][idx])
+        return VoterPopulation.rankings(self,partypos,idx)
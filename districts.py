@@ -0,0 +1,199 @@
+import math
+import statistics
+import numpy as np
+try:
+    from scipy import special
+    from scipy.spatial import cKDTree
+except ImportError:
+    special = cKDTree = None
+
+# GEOGRAPHICALLY CORRELATED DISTRICTING
+
+# Districts are formed by giving every voter a place to live (a location along a line) that is correlated with
+# one of the voter's attributes, e.g. their position on the economic axis, and cutting the line into districts
+# of equal population. The locations follow a Gaussian copula: with the attribute turned into a standard normal
+# score z, a voter's location is
+#     corr*z + sqrt(1-corr**2)*noise
+# with standard normal noise, so that a correlation (corr) of 0 scatters the voters randomly across the districts,
+# and 1 puts voters with similar attributes in the same districts (as contiguous slices of the sorted voters).
+# The same model is used both for individual voters (sortkey, assign) and for vote counts by party
+# (voteshares, splitvotes), where the voters of each party are taken to have the attributes between
+# those of the parties before and after it, so the counts of each party in each district are drawn without
+# generating any votes.
+
+# Example usage:
+# pop.sort(sortkey(pop.positions[:,0], 0.7)); pop.evenreg(el, 650)  # a VoterPopulation registered in 650 districts
+# splitvotes([6000000, 3000000, 1000000], 650, 0.7)                  # a 650 x 3 matrix of the votes of three parties
+
+# standard normal distribution function and its inverse (with SciPy, or element by element without it)
+if special is not None:
+    ncdf, nppf = special.ndtr, special.ndtri
+else:
+    def ncdf(x):
+        return np.asarray(np.frompyfunc(lambda v: 0.5*math.erfc(-v/math.sqrt(2.)),1,1)(x),dtype=float)
+
+    def nppf(p):
+        return np.asarray(np.frompyfunc(statistics.NormalDist().inv_cdf,1,1)(p),dtype=float)
+
+def generator(rng):
+    return np.random if rng is None else rng
+
+# the location of each voter, given an attribute of each (an array),
+# with voters of close attributes living close to each other when /corr/ is high.
+# The attribute is standardised, which makes the locations follow a Gaussian copula of normally distributed attributes.
+# /rng/: a numpy Generator (by default, the numpy.random module)
+def sortkey(attr,corr=0.5,rng=None):
+    attr = np.asarray(attr,dtype=float)
+    std = attr.std()
+    z = (attr-attr.mean())/std if std > 0 else np.zeros(len(attr))
+    return corr*z+math.sqrt(max(0.,1-corr*corr))*generator(rng).standard_normal(len(attr))
+
+# the order of an array of float keys (as np.argsort), found by sorting the keys with their indices packed into their
+# lowest bits, which is several times faster than an argsort for millions of keys but only orders keys differing
+# beyond their (number of index bits) lowest bits of precision, which is plenty for placing voters
+def keyorder(key):
+    key = np.ascontiguousarray(key,dtype=np.float64)
+    bits = max(1,(len(key)-1).bit_length())
+    if bits > 40:
+        return np.argsort(key)
+    ints = key.view(np.int64)
+    ints = ints^((ints >> 63) & np.int64(0x7fffffffffffffff)) # integers in the order of the floats
+    packed = ((ints >> bits) << bits) | np.arange(len(key),dtype=np.int64)
+    packed.sort()
+    return packed & ((1 << bits)-1)
+
+# the district (0 to /nsub/-1) of each voter with the given attribute, for districts of equal population
+# formed from the locations given by sortkey
+def assign(attr,nsub,corr=0.5,rng=None):
+    order = keyorder(sortkey(attr,corr,rng))
+    district = np.empty(len(order),dtype=np.int32)
+    district[order] = np.arange(len(order),dtype=np.int64)*nsub//max(len(order),1)
+    return district
+
+# shares of each party's votes falling into each of /nsub/ districts of equal (expected) population (a parties x districts matrix),
+# for a list or array of the /votes/ of each party, with the parties ordered by their attribute.
+# The shares are integrated over the attributes of each party's voters with /nodes/-point Gauss-Legendre quadrature.
+def voteshares(votes,nsub,corr=0.5,nodes=48):
+    votes = np.asarray(votes,dtype=float)
+    ends = votes.cumsum()/max(votes.sum(),1.)
+    starts = ends-votes/max(votes.sum(),1.)
+    cuts = np.arange(nsub+1)/nsub
+    noise = math.sqrt(max(0.,1-corr*corr))
+    if noise == 0: # each party's voters live along their own stretch of the line
+        shares = np.clip(np.minimum(cuts[None,1:],ends[:,None])-np.maximum(cuts[None,:-1],starts[:,None]),0,None)
+    else:
+        x, w = np.polynomial.legendre.leggauss(nodes)
+        u = starts[:,None]+(ends-starts)[:,None]*(x+1)/2 # attribute quantiles of the voters of each party
+        z = nppf(np.clip(u,1e-300,1-1e-16))
+        qs = np.concatenate([[-np.inf],nppf(cuts[1:-1]),[np.inf]]) # locations of the district boundaries
+        cdf = ncdf((qs[None,None,:]-corr*z[:,:,None])/noise)
+        shares = np.einsum("k,pkd->pd",w/2,np.diff(cdf,axis=2))
+    shares = np.maximum(shares,0)
+    return shares/np.maximum(shares.sum(1,keepdims=True),1e-300)
+
+# a districts x parties matrix of vote counts, splitting the /votes/ of each party (a list or an array,
+# with the parties ordered by their attribute) between /nsub/ districts according to voteshares
+def splitvotes(votes,nsub,corr=0.5,rng=None,nodes=48):
+    shares = voteshares(votes,nsub,corr,nodes)
+    rng = generator(rng)
+    return np.array([rng.multinomial(int(v),s) for v, s in zip(votes,shares)],dtype=np.int64).reshape(len(shares),nsub).T
+
+# SPATIAL DISTRICTS
+
+# Voters can also be given places on a map (coordinates in the unit square), and districts formed as compact regions
+# of equal population (differing by at most one voter). The regions are first found by recursive bisection, i.e. as
+# the cells of a KD-tree splitting the voters into parts of the right sizes along the wider side of each part.
+# They are then made rounder by a capacity-constrained k-means: in each round, the districts are paired with
+# neighbouring ones, and the voters of each pair are split between them in the best way keeping their populations,
+# i.e. by their position along the line between the two district centres (at the boundary of a Voronoi diagram
+# with weighted centres), after which the centres move to the middle of their voters.
+# Neighbouring districts are found with a KD-tree over the centres if SciPy is available, or by comparing distances
+# to all centres otherwise.
+
+# Example usage:
+# pop.coords = places(pop.positions[:,0], 300, 0.5)   # voters in 300 towns, economically similar voters in the same ones
+# pop.spatialreg(el, 650)                              # registered in 650 districts of el (see VoterPopulation.spatialreg)
+# spatial(coords, 1000)                                # the districts of 1000 as an array (e.g. for SuperElection.addBallots)
+
+# coordinates (an N x 2 array) of voters living in /ntowns/ towns of random sizes and places (within the unit square),
+# each spread around its centre in proportion to its size (/spread/ for the largest town). Voters are sorted into
+# the towns by the sort key of their attribute (see sortkey), so with a high /corr/, voters of similar attributes
+# live in the same towns.
+def places(attr,ntowns=100,corr=0.5,spread=0.05,rng=None):
+    rng = generator(rng)
+    n = len(attr)
+    sizes = rng.pareto(1.,ntowns)+1 # town sizes roughly follow Zipf's law
+    ends = np.round(np.cumsum(sizes)/sizes.sum()*n).astype(np.int64)
+    town = np.empty(n,dtype=np.int64)
+    town[keyorder(sortkey(attr,corr,rng))] = np.repeat(np.arange(ntowns),np.diff(np.concatenate([[0],ends])))
+    centres = rng.uniform(0.,1.,(ntowns,2))
+    radii = spread*np.sqrt(sizes/sizes.max())
+    return np.clip(centres[town]+rng.standard_normal((n,2))*radii[town,None],0.,1.)
+
+# the districts (0 to /nsub/-1) of points given by recursive bisection, with populations differing by at most one
+def bisect(points,nsub):
+    district = np.empty(len(points),dtype=np.int32)
+    parts = [(np.arange(len(points)),0,nsub)] # voters, first district and number of districts of each part
+    while parts:
+        idx, first, k = parts.pop()
+        if k == 1:
+            district[idx] = first
+            continue
+        sub = points[idx]
+        axis = int(np.ptp(sub[:,1]) > np.ptp(sub[:,0])) if len(idx) else 0
+        cut = len(idx)*(k//2)//k
+        split = np.argpartition(sub[:,axis],cut) if 0 < cut < len(idx) else np.arange(len(idx))
+        parts.append((idx[split[:cut]],first,k//2))
+        parts.append((idx[split[cut:]],first+k//2,k-k//2))
+    return district
+
+# the indices of the /k/ nearest centres to each point (an N x k array, nearest first)
+def nearest(points,centres,k=1):
+    k = min(k,len(centres))
+    if cKDTree is not None:
+        return cKDTree(centres).query(points,k)[1].reshape(len(points),k)
+    d2 = ((points[:,None,:]-centres[None,:,:])**2).sum(2)
+    return np.argsort(d2,axis=1,kind="stable")[:,:k]
+
+# the mean position of the points of each district
+def centroids(points,district,nsub):
+    sizes = np.bincount(district,minlength=nsub)
+    sums = np.column_stack([np.bincount(district,points[:,i],nsub) for i in range(2)])
+    return sums/np.maximum(sizes,1)[:,None]
+
+# pairs of neighbouring districts, matched greedily in random order from the /k/ nearest centres of each:
+# the partner of each district (-1 for none)
+def pairs(centres,k=6,rng=None):
+    near = nearest(centres,centres,k+1)
+    partner = np.full(len(centres),-1)
+    for a in generator(rng).permutation(len(centres)).tolist():
+        if partner[a] < 0:
+            for b in near[a].tolist():
+                if b != a and partner[b] < 0:
+                    partner[a], partner[b] = b, a
+                    break
+    return partner
+
+# splits the points of each pair of districts (see pairs) between the two, keeping their populations,
+# by the points' positions along the line from one centre to the other (changing /district/ in place)
+def resplit(points,district,centres,partner):
+    sizes = np.bincount(district,minlength=len(centres))
+    idx = np.flatnonzero(partner[district] >= 0)
+    first = np.minimum(district[idx],partner[district[idx]])
+    other = partner[first]
+    along = ((points[idx]-centres[first])*(centres[other]-centres[first])).sum(1)
+    order = np.lexsort((along,first))
+    first = first[order]
+    rank = np.arange(len(order))-np.searchsorted(first,first)
+    district[idx[order]] = np.where(rank < sizes[first],first,partner[first])
+
+# the district (0 to /nsub/-1) of each voter given their /coords/ (an N x 2 array), for /nsub/ compact geographic
+# districts with populations differing by at most one. The districts start from those of bisect, and are made rounder
+# in /rounds/ rounds of the capacity-constrained k-means (none keeps the bisection).
+def spatial(coords,nsub,rounds=10,rng=None):
+    coords = np.asarray(coords,dtype=float)
+    district = bisect(coords,nsub)
+    for r in range(rounds if nsub > 1 else 0):
+        centres = centroids(coords,district,nsub)
+        resplit(coords,district,centres,pairs(centres,rng=rng))
+    return district
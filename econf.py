@@ -1,7 +1,14 @@
 import parliament
 import westminster
+import tempfile
+import functools
+import time
+import os
+import concurrent.futures
+import districts
 
 from SuperElection import *
+from VoterPopulation import *
 
 # AN EXPERIMENTAL MULTI-ELECTION SIMULATOR
 
@@ -17,18 +24,65 @@ from SuperElection import *
 # elcyc(650, "FPTP", "wm", "fins") # UK general elections
 # elcyc(225, "FPTP", "fins", al=("listPR",225,"lr"), pres=(1,"TRS","s")) # Russian duma (w/o 5% threshold) and presidential elections
 # elcyc(577, "TRS", "fins", pres=(1,"TRS", "s")) # French legislative and presidential elections
+# elcyc(299, "FPTP", "fins", al=("MMP",598,2,5,3,"level")) # German Bundestag (mixed-member proportional with levelling seats)
 # elcyc(19, "IRVlistPR", 19, 2, "fins") # Proportional representation with the Sainte-Lague method in 19 19-seat districts
 
 # Initialisation
 e = SuperElection("Election")
-vs = [Voter([e]) for i in range(int(700000*random.gauss(1,0.2)))] # randomly sized list of voters
 ncenter = random.random()
 nspread = 0.5
 n = lambda: random.gauss(ncenter,nspread)
 
-# voters distributed according to their position on the right-left axis, 
-# enabling somewhat realistic modeling of electoral districts
-vs.sort(key=lambda l: l.position[0]*n()*random.gauss(1,nspread))
+# The electorate (vs) is only built when first needed (by electorate(), or on access to econf.vs), either
+# from scratch or, if /snapshot/ names an existing file, from an electorate saved with saveelectorate
+snapshot = None
+
+def electorate():
+    global vs
+    if "vs" not in globals():
+        if snapshot and os.path.exists(snapshot):
+            loadelectorate(snapshot)
+        else:
+            vs = VoterPopulation(int(700000*random.gauss(1,0.2)),[e]) # randomly sized population of voters
+            # voters distributed according to their position on the right-left axis, with a correlation of ncenter
+            # between the two (see districts.sortkey), enabling somewhat realistic modeling of electoral districts
+            vs.order = vs.sort(districts.sortkey(vs.positions[:,0],ncenter))
+    return vs
+
+def __getattr__(name):
+    if name == "vs":
+        return electorate()
+    raise AttributeError("module 'econf' has no attribute '%s'" % name)
+
+# Saves the electorate (voter positions, districts and the order they were sorted in) with the current states
+# of the random number generators and the district layout parameter (ncenter), as an .npz file
+def saveelectorate(path, pop=None):
+    pop = electorate() if pop is None else pop
+    pyversion, pystate, gauss = random.getstate()
+    npname, npkeys, nppos, nphasgauss, npgauss = np.random.get_state()
+    np.savez(path, positions=pop.positions, district=pop.district,
+             order=getattr(pop, "order", np.arange(len(pop))), ncenter=ncenter,
+             **({} if pop.coords is None else {"coords": pop.coords}),
+             pystate=np.array(pystate, dtype=np.int64), pyversion=pyversion, pygauss=np.nan if gauss is None else gauss,
+             npkeys=npkeys, npextra=np.array([nppos, nphasgauss, npgauss]))
+
+# Loads a saved electorate as vs (registered in e), restoring the random number generators to their states when it was saved
+# unless /rngs/ is False. Returns the electorate.
+def loadelectorate(path, rngs=True):
+    global vs, ncenter
+    with np.load(path) as snap:
+        vs = VoterPopulation(regs=[e], positions=snap["positions"])
+        vs.district = snap["district"]
+        vs.order = snap["order"]
+        if "coords" in snap.files:
+            vs.coords = snap["coords"]
+        ncenter = snap["ncenter"].item()
+        if rngs:
+            gauss = snap["pygauss"].item()
+            random.setstate((snap["pyversion"].item(), tuple(snap["pystate"].tolist()), None if math.isnan(gauss) else gauss))
+            nppos, nphasgauss, npgauss = snap["npextra"].tolist()
+            np.random.set_state(("MT19937", snap["npkeys"], int(nppos), int(nphasgauss), npgauss))
+    return vs
 
 # some plausible parties and political positions in a multi-party democracy
 e.addPositions((u"Cyan",0.5,0.1),(u"Pink",-0.6,-0.2),(u"Orange",0.2,-1),(u"Yellow",1.2,-0.4),(u"Black",0,0),(u"Navy",0.1,1.3),(u"Green",-0.7,-1.6),(u"Crimson",-2,-0.1),(u"Maroon",-1.8,1),(u"Brown",-0.2,2.5))
@@ -37,56 +91,66 @@ e.addPositions((u"Cyan",0.5,0.1),(u"Pink",-0.6,-0.2),(u"Orange",0.2,-1),(u"Yello
 # parameters: number of districts (subelections), followed by runGenElection parameters for the electoral system
 def econf(nsub=50, *args, **kwargs):
     
-    global vs
     global e
-    for s in e.subelections+[e]:
-        s.clearVotes()
+    return holdelection(e, electorate(), nsub, *args, **kwargs)
 
-    e.numSubs(nsub)
-    for i in range(len(vs)):
-        vs[i].newreg(e,e.sub(int(i*1.*nsub/len(vs))))
-
-    for v in vs:
-        v.vote()
+# the election of econf, held in /el/ by the voters of /pop/
+def holdelection(el, pop, nsub=50, *args, **kwargs):
+    el.clearVotes()
+    el.resetSubs(nsub)
+    if pop.coords is not None: # geographic districts
+        pop.spatialreg(el,nsub)
+    else:
+        pop.evenreg(el,nsub)
+    pop.vote()
     
     if args:
-        e.runGenElection(*args, **kwargs)
+        el.runGenElection(*args, **kwargs)
     else:
-        e.runGenElection("IRVlistPR",13,"fins")
+        el.runGenElection("IRVlistPR",13,"fins")
     
-    return e
+    return el
     
 # reposition the voters politically, given the most likely government formed    
 def newpos(vtrlist, el=None):
+    pulls = {}
     if el:
         rulingpos = [el.positions[p] for p in mlcoal(el)[0]]
         rulingpos = tuple(map(lambda l: sum(l)*1./len(rulingpos),zip(*rulingpos)))
-        allpos = list(zip(*[vtr.position for vtr in vtrlist]))
-        meanpos = (sum(allpos[0])*1./len(vtrlist), sum(allpos[1])*1./len(vtrlist))
-    else:
-        rulingpos = None
+        pulls = dict(ruling=rulingpos,rulepull=0.1,meanpull=0.05,centrepull=0.05)
     meanshift = (random.gauss(0,0.1),random.gauss(0,0.05))
-    for vtr in vtrlist:
-        if rulingpos:
-            vtr.pos(random.gauss(vtr.position[0]+meanshift[0]
-                    -0.1*(rulingpos[0]-vtr.position[0])
-                    +0.05*(meanpos[0]+meanshift[0]-vtr.position[0])
-                    +0.05*(0.0-vtr.position[0]),0.1),
-                    random.gauss(vtr.position[1]+meanshift[1]
-                    -0.1*(rulingpos[1]-vtr.position[1])
-                    +0.05*(meanpos[1]+meanshift[1]-vtr.position[1])
-                    +0.05*(0.0-vtr.position[1]), 0.05))
-        else:
-            vtr.pos(random.gauss(vtr.position[0]+meanshift[0],0.1), random.gauss(vtr.position[1]+meanshift[1], 0.05))
+    if isinstance(vtrlist, VoterPopulation): # the same step for all voters at once, chunk by chunk
+        vtrlist.drift(meanshift,(0.1,0.05),**pulls)
+        return
+    vpos = np.array([vtr.position for vtr in vtrlist],dtype=float).reshape(-1,2)
+    if el:
+        pulls["mean"] = vpos.mean(0)
+    newpos = np.random.normal(driftmean(vpos,meanshift,**pulls),(0.1,0.05))
+    for vtr, pos in zip(vtrlist,newpos.tolist()):
+        vtr.pos(*pos)
 
+# An opinion poll of /samplesize/ random voters of /vtrlist/ on a {party: position} dictionary (/poses/).
+# Arg options: "s" to print the result, "el" to return the poll as an Election rather than first preference percentages,
+# "strat" to sample each district in proportion to its size (VoterPopulation only).
+# For a VoterPopulation, the sample is drawn as an array of voter indices and counted in one vectorised step.
 def poll(vtrlist,poses,samplesize=500,*args):
     testel = Election()
     testel.positions = {x : y for x,y in poses.items()}
-    sample = random.sample(vtrlist,samplesize)
-    for vtr in sample:
-        vtr.reg(testel)
-        vtr.vote(-1)
-        vtr.dereg(testel)
+    if isinstance(vtrlist, VoterPopulation):
+        sample = vtrlist.sample(samplesize,"strat" in args)
+        if "el" in args:
+            cands, rankings = vtrlist.rankings(testel.positions,sample)
+            testel.addRankings(cands,rankings,np.ones(len(sample),dtype=np.int64))
+        else:
+            cands = list(testel.positions.keys())
+            counts = vtrlist.firstprefs([testel.positions[c] for c in cands],sample)
+            testel.firstprefs = Counter({c: n for c, n in zip(cands,counts.tolist()) if n})
+    else:
+        sample = random.sample(vtrlist,samplesize)
+        for vtr in sample:
+            vtr.reg(testel)
+            vtr.vote(-1)
+            vtr.dereg(testel)
     if "s" in args:
         print(valsorted(percentages(testel.firstprefs,2)))
     if "el" in args:
@@ -95,33 +159,138 @@ def poll(vtrlist,poses,samplesize=500,*args):
         return Counter(percentages(testel.firstprefs))
     
         
-# reposition parties in a vote-seeking manner
-def partyrepos(el,vtrlist):
+# reposition parties in a vote-seeking manner: each party tries a random step, which it keeps unless it polls
+# worse than its result in the last election. For a VoterPopulation, the steps of all parties are polled at once,
+# each against the current positions of the others, on one common sample.
+def partyrepos(el,vtrlist,method=None,**opts):
+    if method and isinstance(vtrlist, VoterPopulation): # strategic repositioning, see optimizeparties
+        optimizeparties(el,vtrlist,method,**opts)
+        return
+    if isinstance(vtrlist, VoterPopulation):
+        cands = list(el.positions.keys())
+        current = np.array([el.positions[p] for p in cands],dtype=float)
+        steps = np.random.normal(current,0.05)
+        sets = np.repeat(current[None],len(cands),0)
+        sets[np.arange(len(cands)),np.arange(len(cands))] = steps
+        polled = vtrlist.poll(sets,1000)
+        elpcts = Counter(percentages(el.firstprefs))
+        for i, p in enumerate(cands):
+            if polled[i,i] >= elpcts[p]:
+                el.positions[p] = tuple(steps[i].tolist())
+        return
     for p, ppos in el.positions.items():
         el.positions[p] = (random.gauss(ppos[0],0.05),random.gauss(ppos[1],0.05))
         if poll(vtrlist,el.positions,1000)[p] < Counter(percentages(el.firstprefs))[p]:
             el.positions[p] = ppos
             
-# most likely coalition given the existing election result
+# Vote-seeking party positioning: the parties take turns to move to the best of /ncands/ candidate positions,
+# all scored at once by their first preference votes (the other parties staying where they are, see VoterPopulation.trialvotes), until no party
+# can do better (an equilibrium) or the time budget (/budget/ seconds) runs out. Returns the number of rounds and
+# whether an equilibrium was reached. Parameters:
+# method: "hill": hill-climbing, with candidate steps of size /step/ around the current position, the step being halved
+#                 whenever no party finds a better one, down to /minstep/
+#         "best": best response, with candidates spread around the voters (positions of random voters)
+# samplesize: number of voters to score the positions on (one fixed sample for the whole search), or None for all voters
+def optimizeparties(el,pop,method="hill",ncands=32,step=0.1,minstep=0.005,samplesize=20000,budget=1.,maxrounds=100):
+    start = time.perf_counter()
+    cands = list(el.positions.keys())
+    current = np.array([el.positions[p] for p in cands],dtype=float)
+    idx = pop.sample(samplesize) if samplesize and samplesize < len(pop) else slice(None)
+    vpos = pop.positions[idx] if method == "best" else None
+    rounds, settled = 0, False
+    while rounds < maxrounds and not settled and time.perf_counter()-start < budget:
+        rounds += 1
+        moved = False
+        for i in range(len(cands)):
+            if method == "best":
+                tries = vpos[np.random.randint(len(vpos),size=ncands)]
+            else:
+                tries = np.random.normal(current[i],step,(ncands,2))
+            tries = np.vstack((current[i:i+1],tries)) # the first try is the current position
+            votes = pop.trialvotes(current,i,tries,idx)
+            best = votes.argmax()
+            if votes[best] > votes[0]:
+                current[i] = tries[best]
+                moved = True
+            if time.perf_counter()-start >= budget:
+                break
+        if not moved:
+            if method == "hill" and step/2 >= minstep:
+                step /= 2
+            else:
+                settled = True
+    for i, p in enumerate(cands):
+        el.positions[p] = tuple(current[i].tolist())
+    return rounds, settled
+
+# most likely coalition given the existing election result: the majority coalition whose two most distant parties
+# are the closest together (on ties, the one with the fewest parties, then the first in the order of el.seattotals)
 def mlcoal(el):
-    plur = max(el.seattotals.keys(),key=lambda l: el.seattotals[l])
-    if el.seattotals[plur] > sum(el.seattotals.values())/2.:
-        return [plur], el.seattotals[plur]
-    currbest = []
-    for nparties in range(len(el.seattotals.keys())+1):
-        options = list(filter(lambda l: sum(map(lambda m: el.seattotals[m],l)) > sum(el.seattotals.values())/2.,list(itertools.combinations(el.seattotals.keys(),nparties))))    
-        if options:
-            currbest = [min(currbest+options,key=lambda coal: max(map(lambda p: ((el.positions[p[0]][0]-el.positions[p[1]][0])**2+(el.positions[p[0]][1]-el.positions[p[1]][1])**2)**.5,list(itertools.combinations(coal,2)))))]
-    return sorted(currbest[0], key=lambda l: -el.seattotals[l]), sum(map(lambda l: el.seattotals[l],currbest[0]))
+    coal = mincoal(tuple((p,el.seattotals[p],tuple(el.positions[p])) for p in el.seattotals.keys()))
+    return sorted(coal, key=lambda l: -el.seattotals[l]), sum(map(lambda l: el.seattotals[l],coal))
+
+# The coalition of mlcoal, given the (party, seats, position) of each party, memoized.
+# Parties are held as bits of integer masks. The widest distance allowed between coalition partners is found by a binary search
+# over the pairwise distances, each step looking for a majority among parties all within that distance of each other
+# (a depth-first search over these cliques, pruned as soon as the remaining parties cannot make up a majority).
+# Only minimal majorities are searched, since adding parties to a majority never makes it narrower or smaller.
+@functools.lru_cache(maxsize=1024)
+def mincoal(key):
+    parties = [k for k in key if k[1] > 0] # parties without seats are never in a minimal majority
+    seats = [k[1] for k in parties]
+    pos = [k[2] for k in parties]
+    n = len(parties)
+    half = sum(seats)/2.
+    dist = [[((pos[i][0]-pos[j][0])**2+(pos[i][1]-pos[j][1])**2)**.5 for j in range(n)] for i in range(n)]
+
+    def bits(mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length()-1
+            mask ^= low
+
+    # the first majority (in combinations order) among parties within /width/ of each other,
+    # with /size/ parties (the first of any size if not given)
+    def search(width, size=None):
+        adj = [sum(1 << j for j in range(n) if j != i and dist[i][j] <= width) for i in range(n)]
+        def extend(chosen, total, cands):
+            if total > half:
+                return chosen
+            if size is not None and len(chosen) == size:
+                return None
+            rest = [seats[j] for j in bits(cands)]
+            if size is not None:
+                rest = sorted(rest)[len(rest)-(size-len(chosen)):]
+            if total+sum(rest) <= half:
+                return None
+            for j in bits(cands):
+                found = extend(chosen+[j], total+seats[j], cands & adj[j] & ~((2 << j)-1))
+                if found:
+                    return found
+            return None
+        return extend([], 0, (1 << n)-1)
+
+    widths = sorted(set([0.0]+[dist[i][j] for i in range(n) for j in range(i+1,n)]))
+    lo, hi = 0, len(widths)-1
+    while lo < hi:
+        mid = (lo+hi)//2
+        if search(widths[mid]):
+            hi = mid
+        else:
+            lo = mid+1
+    for size in range(1,n+1):
+        found = search(widths[lo], size)
+        if found:
+            return [parties[i][0] for i in found]
 
 prevresult = {"parl":Counter(),"sen":Counter(),"pres":Counter()}
 
 # reposition parties and voters, configure and hold a new election and display the result as a diagram
 def necdis(etype="parl",*args,**kwargs):            
-    global vs, e, prevresult
+    global e, prevresult
     if e.seattotals :
-        partyrepos(e,vs)
-        newpos(vs,e)
+        partyrepos(e,electorate())
+        newpos(electorate(),e)
     e = econf(*args,**kwargs)
     print(str(sorted({p:Counter(e.seattotals)[p]-prevresult[etype][p] for p in set(e.seattotals)|set(prevresult[etype])}.items(), key= lambda l: -Counter(e.seattotals)[l[0]])).replace("', ","', +").replace("+-","-"))
     if sum(e.seattotals.values()) == 1 and sum(prevresult[etype].values()) in (0,1):
@@ -146,6 +315,73 @@ def necdis(etype="parl",*args,**kwargs):
     
 nelcyc = 0    
 
+# Runs /nsims/ independent simulations of /ncycles/ elections each, starting from the current voters and parties
+# (like repeated calls of necdis, without the diagrams): parties and voters reposition themselves between elections,
+# and the most likely government is formed after each. Takes the arguments of econf, plus the keyword args:
+#   "procs": number of worker processes to run the simulations in (in this process, one after another, by default)
+#   "seed": seed of the random streams, one per simulation, so that results do not depend on the number of processes
+#   "quantiles": seat quantiles to compute (default 5%, median and 95%)
+# The voters are saved once as a memory-mapped population, shared by all simulations as a read-only (copy-on-write) base.
+# Nothing is printed from the simulations: the printing options of the electoral systems ("fins", "s", "paths") are left
+# out, and without an electoral system, the default of holdelection is run without printing its results.
+# Returns a dict of:
+#   "seats": {party: (nsims x ncycles) array of seats}
+#   "govs": {coalition (tuple of parties): share of the elections after which it would govern}
+#   "quantiles": {party: {quantile: seats}}, over all elections
+def ensemble(nsims, ncycles, nsub=50, *args, **kwargs):
+    procs = kwargs.pop("procs", None)
+    seed = kwargs.pop("seed", None)
+    qs = kwargs.pop("quantiles", (0.05,0.5,0.95))
+    if seed is None:
+        seed = random.getrandbits(64)
+    seeds = [s.generate_state(2).tolist() for s in np.random.SeedSequence(seed).spawn(nsims)]
+    vs = electorate()
+    with tempfile.TemporaryDirectory() as tmp:
+        if isinstance(vs, MappedPopulation):
+            vs.flush()
+            path = vs.path
+        else:
+            path = MappedPopulation.fromPopulation(vs, tmp, mode="r").path
+        jobs = [(path, dict(e.positions), ncycles, nsub, args, kwargs, s) for s in seeds]
+        if procs:
+            with concurrent.futures.ProcessPoolExecutor(procs) as pool:
+                results = list(pool.map(simulate, jobs))
+        else:
+            results = [simulate(job) for job in jobs]
+    parties = sorted(set(p for res in results for seats, gov in res for p in seats))
+    seats = {p: np.array([[seats.get(p,0) for seats, gov in res] for res in results]) for p in parties}
+    govs = Counter(gov for res in results for seats, gov in res)
+    return {"seats": seats,
+            "govs": {gov: n*1./(nsims*ncycles) for gov, n in govs.most_common()},
+            "quantiles": {p: dict(zip(qs, np.quantile(seats[p], qs).tolist())) for p in parties}}
+
+# election args without the options that print results
+def quiet(args):
+    return tuple(a for a in args if not (isinstance(a, str) and a in ("fins", "s", "paths")))
+
+# one simulation of the ensemble above, on a copy-on-write view of the voters saved in /path/
+def simulate(job):
+    path, positions, ncycles, nsub, args, kwargs, (pyseed, npseed) = job
+    args = quiet(args) if args else ("IRVlistPR",13)
+    if "al" in kwargs:
+        kwargs = dict(kwargs, al=quiet(kwargs["al"]))
+    state, npstate = random.getstate(), np.random.get_state()
+    random.seed(pyseed)
+    np.random.seed(npseed)
+    el = SuperElection("Election")
+    el.addPositions(*[(p,)+tuple(pos) for p, pos in positions.items()])
+    pop = MappedPopulation(path, regs=[el], mode="c")
+    history = []
+    for cycle in range(ncycles):
+        if cycle:
+            partyrepos(el, pop)
+            newpos(pop, el)
+        holdelection(el, pop, nsub, *args, **kwargs)
+        history.append((dict(el.seattotals), tuple(sorted(mlcoal(el)[0]))))
+    random.setstate(state)
+    np.random.set_state(npstate)
+    return history
+
 # run an entire electoral cycle, with possible separate presidential and upper house (senate) elections 
 def elcyc(*args,**kwargs):             
     global nelcyc
@@ -2,18 +2,21 @@ import random
 import numpy as np
 from collections import Counter
 import itertools
+from Election import mmpseats
+from districts import splitvotes
 
 # this file contains quick random election simulations
 
 def randvs(*args):
     """
-    Generates a string containing a number of copies (representing votes) of a single character,
-    where the number follows a uniform distribution within a given range.
-    1st arg: a character, denoting a party
-    2nd arg: minimum nuber of votes
-    3rd arg: maximum number of votes
+    Generates a Counter of votes for each party,
+    where the number of votes follows a uniform distribution within a given range.
+    Each argument is a (party, minimum votes, maximum votes) tuple:
+    1st item: a character, denoting a party
+    2nd item: minimum nuber of votes
+    3rd item: maximum number of votes
     """
-    return list("".join([a[0]*random.randrange(a[1],a[2]) for a in args]))
+    return Counter({a[0]:random.randrange(a[1],a[2]) for a in args})
 
 # concatenate a list of lists into one list
 def concat(lst):
@@ -26,34 +29,88 @@ def csum(itble):
         cs += cntr
     return cs
 
+# numpy random generator following the state of the random module
+def newrng():
+    return np.random.default_rng(random.getrandbits(64))
+
+class VoteGroups:
+    """
+    Votes grouped into constituencies, stored as a (constituencies x parties) matrix of vote counts.
+    Indexing with an integer (or iterating) gives the votes of a constituency as a Counter,
+    indexing with a slice or a list of constituencies gives another VoteGroups.
+    """
+    def __init__(self, parties, counts):
+        self.parties = list(parties)
+        self.counts = np.asarray(counts,dtype=np.int64).reshape(-1,len(self.parties))
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, i):
+        if isinstance(i,(int,np.integer)):
+            return Counter({p:n for p,n in zip(self.parties,self.counts[i].tolist()) if n})
+        return VoteGroups(self.parties,self.counts[i])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    # votes of all constituencies together
+    def total(self):
+        return colsum(self.parties,self.counts)
+
+    # the same constituencies without the votes of some parties
+    def without(self, parties):
+        keep = [i for i,p in enumerate(self.parties) if p not in parties]
+        return VoteGroups([self.parties[i] for i in keep],self.counts[:,keep])
+
+# Counter of the column sums of a (constituencies x parties) matrix, e.g. of votes or seats
+def colsum(parties,matrix):
+    return Counter({p:n for p,n in zip(parties,np.asarray(matrix).sum(0).tolist()) if n})
+
 def group(lst,num):
     """
-    Group an iterable (lst) into a certain number (num) of groups.
+    Group votes (a Counter or a list of votes) into a certain number (num) of groups
+    of equal size, with each party's votes kept together in the order of the parties.
     The groups are used to represent constituencies.
     """
-    gsz = len(lst)//num
-    rem = num - gsz
-    gl = [lst[i*gsz:(i+1)*gsz] for i in range(num)]
-    gl[-1] += lst[-rem:]
-    return gl
-
-# default settings for vote order arrangement based on normal distribution
-ncenter = random.random()
-nspread= 0.1
-norm = lambda: random.gauss(ncenter,nspread)%1
+    tally = Counter(lst)
+    parties = list(tally.keys())
+    votes = np.array([tally[p] for p in parties],dtype=np.int64)
+    ends = votes.cumsum()
+    bounds = np.arange(num+1)*(votes.sum()//num)
+    bounds[-1] = votes.sum()
+    # overlap of each group's slice of the votes with each party's slice
+    lo = np.maximum(bounds[:-1,None],(ends-votes)[None,:])
+    hi = np.minimum(bounds[1:,None],ends[None,:])
+    return VoteGroups(parties,np.maximum(hi-lo,0))
+
+# default correlation between the parties' places on the political spectrum and where their voters live,
+# for vote grouping based on normal distribution (see districts.voteshares)
+ncorr = 0.9
 
 def rgroup(lst,num,ndist=False):
     """
-    Group the votes in a list (lst) into a number (num) of groups randomly,
-    i.e. after shuffling the list. The shuffling follows a normal distribution
-    if (ndist) is set to True.
+    Group votes (a Counter or a list of votes) into a number (num) of groups randomly,
+    splitting each party's votes between the groups without drawing individual votes.
+    With (ndist) set to False, the votes are split like a random shuffle would (multivariate
+    hypergeometrically), giving groups of equal size.
+    With (ndist) set to True, the votes are clustered around the parties' strongholds (see districts.splitvotes),
+    with parties next to each other in (lst) sharing them, giving groups of roughly equal size.
+    The correlation behind the clustering is ncorr, or (ndist) itself if it is a number.
     """
-    slst = lst[:]
+    tally = Counter(lst)
+    parties = list(tally.keys())
+    votes = np.array([tally[p] for p in parties],dtype=np.int64)
+    rng = newrng()
     if ndist:
-         random.shuffle(slst,norm)
-    else:
-         random.shuffle(slst)
-    return group(slst,num)
+        return VoteGroups(parties,splitvotes(votes,num,ncorr if ndist is True else ndist,rng))
+    counts = np.zeros((num,len(parties)),dtype=np.int64)
+    left = np.full(num,votes.sum()//num,dtype=np.int64)
+    left[-1] += votes.sum()-left.sum()
+    for i in range(len(parties)):
+        counts[:,i] = rng.multivariate_hypergeometric(left,votes[i])
+        left -= counts[:,i]
+    return VoteGroups(parties,counts)
 
 # represents a dictionary statistic (e.g. vote or seat totals) as percentages 
 def pcts(dicti, rounding=2):
@@ -61,24 +118,61 @@ def pcts(dicti, rounding=2):
 
 #### The following functions compute seat distribution statistics (Counters) based on ####
 #### generated, and if necessary, grouped, votes using different electoral systems    ####
+#### Single constituencies (g) are vote Counters, groups of them (gs) are VoteGroups  ####
 
 # first-past-the-post in each constituency in gs
 def fpps(gs):
-    return Counter([max(set(g),key=lambda l:g.count(l)) for g in gs])
+    cast = gs.counts.sum(1) > 0
+    return Counter([gs.parties[i] for i in gs.counts[cast].argmax(1)])
 
 # random choice of (sts) voters in a constituency (g)
 def rch(g,sts=1):
-    return Counter(np.random.choice(g,sts, replace=False))
+    parties = list(g.keys())
+    chosen = newrng().multivariate_hypergeometric(np.array([g[p] for p in parties],dtype=np.int64),sts)
+    return Counter({p:n for p,n in zip(parties,chosen.tolist()) if n})
 
 # one voter elected at random in each constituency
 def sorts(gs):
-    return Counter([random.choice(g) for g in gs])
+    counts = gs.counts[gs.counts.sum(1) > 0]
+    cums = counts.cumsum(1)
+    drawn = newrng().integers(0,cums[:,-1])
+    return Counter([gs.parties[i] for i in (cums > drawn[:,None]).argmax(1)])
+
+def prseats(counts,sts,prm=1,thresh=0,minpties=1):
+    """
+    Proportional representation in every constituency at once using a highest averages method,
+    giving the same seats as pr (without mmp) in each constituency, as a (constituencies x parties) matrix.
+    The seats of all constituencies are found in one pass by sorting the averages of each party
+    for its 1st to (sts)th seat (a constituencies x parties x seats array).
+
+    counts: (constituencies x parties) matrix of votes
+    sts: number of seats in each constituency
+    prm: interval between divisors (as in pr), or an array of intervals, one for each constituency
+    thresh, minpties: as in pr
+    """
+    counts = np.asarray(counts,dtype=float)
+    ncons, npties = counts.shape
+    if isinstance(prm,str) or sts <= 0 or not npties:
+        return np.zeros((ncons,npties),dtype=np.int64)
+    # parties over the threshold, and the (minpties) parties with the most votes
+    passed = counts*100. >= thresh*counts.sum(1,keepdims=True)
+    np.put_along_axis(passed,np.argsort(-counts,axis=1,kind="stable")[:,:minpties],True,axis=1)
+    votes = np.where(passed,counts,0.)
+    held = np.arange(sts)
+    prm = np.reshape(prm,(-1,1,1)) if np.ndim(prm) else prm
+    with np.errstate(invalid="ignore"):
+        divisors = np.where(held==0,1.,1.+prm*held)
+    averages = (votes[:,:,None]/divisors).reshape(ncons,-1)
+    # ties go to the first party, as in pr
+    winners = np.argsort(-averages,axis=1,kind="stable")[:,:sts]//sts
+    winners += np.arange(ncons)[:,None]*npties
+    return np.bincount(winners.ravel(),minlength=ncons*npties).reshape(ncons,npties)
 
 def pr(g,sts,prm=1,thresh=0,minpties=1,mmp=None,oh=False):
     """
     Proportional representation in a single constituency using a highest averages method.
 
-    g: votes as characters
+    g: votes (a Counter)
     sts: number of seats to be distributed
     prm: interval between divisors for consecutive seats for a party in seat distribution (e.g. 1 for d'Hondt, 2 for Sainte-Lague)
     thresh: percentage threshold for a party to be allocated any seats at all (passing it doesn't guarantee seats)
@@ -86,39 +180,24 @@ def pr(g,sts,prm=1,thresh=0,minpties=1,mmp=None,oh=False):
     mmp: an initial seat distribution statistic (dictionary or Counter) (e.g. FPP results) to which seats are added
          so that the overall result is as proportional as possible (given the divisor interval)
     oh: if True, as many overhang seats beyond (sts) are added as are necessary in order to give each party
-        at least as many seats as they would have been allocated if all (sts) seats were allocated proportionally
+        at least as many seats as they would have been allocated if all (sts) seats were allocated proportionally;
+        if "kept", the constituency seats of parties under the threshold are first taken off (sts), as in Germany and New Zealand
+        (with True, they are overhang seats)
+    With mmp, the seats are found by Election.mmpseats (see also mmps).
     """
     tally = Counter(g)
-    totv = sum(tally.values())
-    nonex = [x[0] for x in sorted(tally.items(),key=lambda l:l[1],reverse=True)[:minpties]]
-    for t in tally.keys():
-        if tally[t]*100./totv < thresh and t not in nonex:
-            tally[t] = 0
-    result = Counter()
-    if mmp:
-        if callable(mmp[0]):
-            try:
-                result = mmp[0](mmp[1],g,*mmp[2:])
-            except TypeError:
-                result = mmp[0](g,*mmp[1:])
-        else:
-            result = mmp
-        for r in list(result.keys())*(not oh):
-            tally[r] /= (1.+prm*result[r])
-        mmpresult = result
-    if oh:
-        result = Counter({x:0 for x in tally.keys()})
+    if not mmp:
+        return colsum(list(tally.keys()),prseats([list(tally.values())],sts,prm,thresh,minpties))
+    if not isinstance(mmp,dict) and callable(mmp[0]):
+        try:
+            result = mmp[0](mmp[1],g,*mmp[2:])
+        except TypeError:
+            result = mmp[0](g,*mmp[1:])
     else:
-        result += Counter({x:0 for x in tally.keys()})
-    if type(prm) is not str:
-        while sum(result.values()) < sts:
-            seatee = max(tally.keys(),key=lambda l:tally[l])
-            result[seatee] += 1
-            tally[seatee] *= (1.+prm*(result[seatee]-1))/(1.+prm*result[seatee])
-    if mmp and oh:
-        for r in result.keys():
-            result[r] = max(mmpresult[r],result[r])
-    return result
+        result = mmp
+    if type(prm) is str:
+        return Counter(result)
+    return Counter(mmpseats(tally,result,sts,prm,thresh,minpties,method="oh" if oh else "ams",deduct=oh != True))
      
      
 
@@ -138,11 +217,24 @@ def gappr(g,sts,factor=1,thresh=0,minpties=1,mmp=None,oh=False):
 
 # proportional representation in each constituency in (gs)
 def prs(gs,sts,prm=1,thresh=0, minpties=1,mmp=None,oh=False):
-    return csum([pr(g,sts,prm,thresh, minpties,mmp,oh) for g in gs])
+    if mmp:
+        return csum([pr(g,sts,prm,thresh, minpties,mmp,oh) for g in gs])
+    return colsum(gs.parties,prseats(gs.counts,sts,prm,thresh,minpties))
      
+# mixed-member proportional representation with (sts) seats in total, where the winners of the constituencies in (gs)
+# are topped up with list seats based on the votes in all of them (see Election.mmpseats for the methods,
+# "ams", "oh" and "level", and for exempt)
+def mmps(gs,sts,prm=1,thresh=0,minpties=1,method="ams",exempt=0):
+    return Counter(mmpseats(gs.total(),fpps(gs),sts,prm,thresh,minpties,exempt,method))
+
 # gap-proportional representation
 def gapprs(gs,sts,factor=1,thresh=0, minpties=1,mmp=None,oh=False):
-    return csum([gappr(g,sts,factor,thresh, minpties, mmp,oh) for g in gs])
+    if mmp:
+        return csum([gappr(g,sts,factor,thresh, minpties, mmp,oh) for g in gs])
+    best2 = -np.sort(-gs.counts,axis=1)[:,:2]
+    with np.errstate(divide="ignore"):
+        gaps = best2[:,0]*1./best2[:,-1]
+    return colsum(gs.parties,prseats(gs.counts,sts,factor*gaps/sts,thresh,minpties))
 
 # first-past-the-post elections for (sts) sub-constituencies held in each constituency in (gs) 
 def subfpps(gs,sts, *args):
@@ -242,14 +334,20 @@ def parallel(sts,gfuncparams,alfuncparams,v):
     
     parallel(253,[[fpps]],[[pr,47,2,3]],partyvotelist)
 
+    Bundestag of Germany:
+    299 FPP seats topped up to 598 seats with Sainte-Lague, a 5% threshold (or 3 FPP seats) and levelling seats
+    (mixed-member proportional, where mmps does the FPP count itself)
+
+    parallel(299,[[mmps,598,2,5,1,"level",3]],[],partyvotelist)
+
     """
     tvl = randvs(*v)
     tvlg = rgroup(tvl,sts)
     print("")
     print(Counter(tvl))
     print(pcts(Counter(tvl)))
-    para = csum([f[0](list(tvlg),*(list(f[1:]))) for f in gfuncparams])
-    para += csum([f[0](list(tvl),*(list(f[1:]))) for f in alfuncparams])
+    para = csum([f[0](tvlg,*(list(f[1:]))) for f in gfuncparams])
+    para += csum([f[0](Counter(tvl),*(list(f[1:]))) for f in alfuncparams])
     print(para)
     print(pcts(para))
     print("")
@@ -268,11 +366,11 @@ def nparallel(sts,gfuncparams,alfuncparams,v):
     print(pcts(Counter(tvl)))
     para = Counter()
     for f in gfuncparams:
-        fres = f[0](list(tvlg),*(list(f[1:])))
+        fres = f[0](tvlg,*(list(f[1:])))
         print(f[0].__name__+":\n"+str(fres)+"\n"+str(pcts(fres)))
         para += fres
     for f in alfuncparams:
-        fres = f[0](list(tvl),*(list(f[1:])))
+        fres = f[0](Counter(tvl),*(list(f[1:])))
         print(f[0].__name__+":\n"+str(fres)+"\n"+str(pcts(fres)))
         para += fres
     print(para)
@@ -306,15 +404,15 @@ def fsor(fsts,ssts,v):
     ftvlg = rgroup(tvl,fsts)
     stvlg = rgroup(tvl,ssts)
     if ftresh:
-        fexcl = [x[0] for x in pcts(Counter(tvl)).items() if x[1]<v[0]]
+        fexcl = [x[0] for x in pcts(tvl).items() if x[1]<v[0]]
         if set(fexcl) == set(tvl):
-            fexcl.remove(max(set(tvl),key=lambda l:tvl.count(l)))
-        ftvlg = [[f for f in g if f not in fexcl] for g in ftvlg]
+            fexcl.remove(tvl.most_common(1)[0][0])
+        ftvlg = ftvlg.without(fexcl)
         if stresh:
-            soexcl = [x[0] for x in pcts(Counter(tvl)).items() if x[1]<v[1]]
+            soexcl = [x[0] for x in pcts(tvl).items() if x[1]<v[1]]
             if set(soexcl) == set(tvl):
                 soexcl = []
-            stvlg = [[f for f in g if f not in soexcl] for g in stvlg]
+            stvlg = stvlg.without(soexcl)
     print(Counter(tvl))
     print(pcts(Counter(tvl)))
     srt = sorts(stvlg)
@@ -345,15 +443,15 @@ def nfsor(fsts,ssts,v):
     ftvlg = rgroup(tvl,fsts,True)
     stvlg = rgroup(tvl,ssts,True)
     if ftresh:
-        fexcl = [x[0] for x in pcts(Counter(tvl)).items() if x[1]<v[0]]
+        fexcl = [x[0] for x in pcts(tvl).items() if x[1]<v[0]]
         if set(fexcl) == set(tvl):
-            fexcl.remove(max(set(tvl),key=lambda l:tvl.count(l)))
-        ftvlg = [[f for f in g if f not in fexcl] for g in ftvlg]
+            fexcl.remove(tvl.most_common(1)[0][0])
+        ftvlg = ftvlg.without(fexcl)
         if stresh:
-            soexcl = [x[0] for x in pcts(Counter(tvl)).items() if x[1]<v[1]]
+            soexcl = [x[0] for x in pcts(tvl).items() if x[1]<v[1]]
             if set(soexcl) == set(tvl):
                 soexcl = []
-            stvlg = [[f for f in g if f not in soexcl] for g in stvlg]
+            stvlg = stvlg.without(soexcl)
     print(Counter(tvl))
     print(pcts(Counter(tvl)))
     srt = sorts(stvlg)
@@ -386,7 +484,7 @@ def uscyclep(v,*args):
     global sen, sencyc, subr
     tvl = randvs(*v)
     tvlg = rgroup(tvl,50,"uniform" not in args)
-    sgs = [tvlg[i-1] for i in range(1,len(tvlg)+1) if (i-sencyc)%3 != 0]
+    sgs = tvlg[[i-1 for i in range(1,len(tvlg)+1) if (i-sencyc)%3 != 0]]
     pres = prs(tvlg,11,0)
     house, subr = subfpps(tvlg,9,*(list(args)+["subr"]))
     up = fpps(sgs)
@@ -398,8 +496,8 @@ def uscyclep(v,*args):
     print(pres)
     print(pcts(pres))
     print("Senate")
-    print(Counter(concat(sgs)))
-    print(pcts(Counter(concat(sgs))))
+    print(sgs.total())
+    print(pcts(sgs.total()))
     print(csum(sen))
     print(pcts(csum(sen)))
     print("House")
@@ -412,7 +510,7 @@ def uscyclem(v,*args):
     global sen, sencyc, subr
     tvl = randvs(*v)
     tvlg = rgroup(tvl,50,"uniform" not in args)
-    sgs = [tvlg[i-1] for i in range(1,len(tvlg)+1) if (i-sencyc)%3 != 0]
+    sgs = tvlg[[i-1 for i in range(1,len(tvlg)+1) if (i-sencyc)%3 != 0]]
     house, subr = subfpps(tvlg,9,*(list(args)+["subr"]))
     up = fpps(sgs)
     sen[sencyc] = up
@@ -420,8 +518,8 @@ def uscyclem(v,*args):
     print(Counter(tvl))
     print(pcts(Counter(tvl)))
     print("Senate")
-    print(Counter(concat(sgs)))
-    print(pcts(Counter(concat(sgs))))
+    print(sgs.total())
+    print(pcts(sgs.total()))
     print(csum(sen))
     print(pcts(csum(sen)))
     print("House")
@@ -437,17 +535,17 @@ def uscyc(v):
     
      
 def withcoal(el,spktr):    
-        """ Description
-        Most likely majority coalition and its combined seats
+    """ Description
+    Most likely majority coalition and its combined seats
 
-        :type el: dict
-        :param el: election result (seats)
-    
-        :type spktr: list
-        :param spktr: political spectrum
-    
-        :rtype: (list, int)
-        """
+    :type el: dict
+    :param el: election result (seats)
+
+    :type spktr: list
+    :param spktr: political spectrum
+
+    :rtype: (list, int)
+    """
     for n in range(1,len(spktr)+1):
         combos = [c for c in itertools.combinations(spktr,n) if sum(map(lambda l:el[l],c))>sum(el.values())/2. and "".join(c) in "".join(spktr)]
         combos.sort(key=lambda l:-sum(map(lambda m:(spktr.index(m)-len(spktr)/2.)**2,l)))
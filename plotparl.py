@@ -1,6 +1,7 @@
 import matplotlib
 import matplotlib.pyplot as plt
 from SuperElection import *
+from VoterPopulation import *
 
 # plots the seat result of an Election as a parliamentary hemicycle using half a matplotlib pie chart
 def plotparl(el, colordict, small=False, inctext=True):
@@ -39,24 +40,41 @@ def plotres(res, colordict, order, small=True, inctext=False):
 
 # EXPERIMENTAL FUNCTIONS follow
 
-# randomly reposition voters in a list
-def randreposition(lst,repmean=0,repstd=0.1, frommean=True, shunpower=True):
-    avgpos = (random.gauss(repmean+meanpos(lst)[0]*int(frommean),repstd), random.gauss(repmean+meanpos(lst)[1]*int(frommean),0.25*repstd))
-    for v in lst:
-        vpos = [random.gauss(v.position[0]+0.1*avgpos[0]-repstd*shunpower*np.mean([el.positions[el.plurality()[0]][0] for el in v.regs]),repstd),random.gauss(v.position[1]+0.1*avgpos[1]-repstd*shunpower*np.mean([el.positions[el.plurality()[0]][1] for el in v.regs]),repstd)]
-        v.pos(*vpos)
+# randomly reposition voters in a list (or a VoterPopulation), away from the plurality winners of their elections.
+# If /partyel/ and /flexes/ are given, the parties of /partyel/ first follow the voters (see followmean).
+def randreposition(lst,repmean=0,repstd=0.1, frommean=True, shunpower=True, partyel=None, flexes=None):
+    mean = lst.meanpos() if isinstance(lst, VoterPopulation) else tuple(np.mean([v.position for v in lst],axis=0))
+    avgpos = (random.gauss(repmean+mean[0]*int(frommean),repstd), random.gauss(repmean+mean[1]*int(frommean),0.25*repstd))
+    shift = (0.1*avgpos[0],0.1*avgpos[1])
+    if isinstance(lst, VoterPopulation):
+        lst.drift(shift,(repstd,repstd),shun=repstd*shunpower,partyel=partyel,flexes=flexes)
+        return
+    if partyel is not None and flexes:
+        followmean(partyel,mean,flexes)
+    wins = {} # plurality winners, found once per election
+    def shunned(v):
+        vwins = [wins.setdefault(id(el),winnerpos(el)) for el in v.regs]
+        vwins = [w for w in vwins if w is not None]
+        return np.mean(vwins,axis=0) if vwins else (0.,0.)
+    shunned = np.array([shunned(v) for v in lst],dtype=float).reshape(-1,2)
+    vpos = np.array([v.position for v in lst],dtype=float).reshape(-1,2)
+    newpos = np.random.normal(driftmean(vpos,shift,shunned=shunned,shun=repstd*shunpower),repstd)
+    for v, pos in zip(lst,newpos.tolist()):
+        v.pos(*pos)
 
 # simulates changes in voters' positions between elections
 def ecyc(rr=True):
     for sub in [e]+e.subelections:
         sub.clearVotes()
-    for v in vs:
-        v.vote()
-    meanpos = (np.mean([v.position[0] for v in vs]),np.mean([v.position[1] for v in vs]))
-    for p in e.positions:
-        e.positions[p] = tuple([e.positions[p][i]+(meanpos[i]-e.positions[p][i])*flexes[p][i]*random.gauss(1,0.1) for i in [0,1]])
+    if isinstance(vs, VoterPopulation):
+        vs.vote()
+    else:
+        for v in vs:
+            v.vote()
     if rr:
-        randreposition(vs)
+        randreposition(vs, partyel=e, flexes=flexes)
+    else:
+        followmean(e, vs.meanpos() if isinstance(vs, VoterPopulation) else tuple(np.mean([v.position for v in vs],axis=0)), flexes)
     for sub in e.subelections:
         sub.positions = e.positions
 
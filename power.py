@@ -0,0 +1,134 @@
+import math
+import numpy as np
+
+# A-PRIORI VOTING POWER OF PARTIES IN A PARLIAMENT
+
+# The power indices below take a seat result ({party: seats}, e.g. Election.seattotals) and the number of seats
+# needed to pass a decision (a majority, more than half of the seats, by default), and return a {party: index} dictionary
+# with the indices of all parties summing to 1.
+# Instead of going through all coalitions, they count coalitions by their combined seats (and sizes) with
+# pseudo-polynomial dynamic programming, in time proportional to (number of parties)^k * (quota), so that e.g.
+# a 60-party, 600-seat chamber takes milliseconds.
+# Counts are exact: 64-bit integers are used for up to 62 parties (whose coalition counts fit in them), Python integers above that.
+
+# Example usage:
+# banzhaf(e.seattotals)
+# shapley({"A": 45, "B": 40, "C": 15})
+# batch(ensemble(100, 5, 650, "FPTP")["seats"], deeganpackel)
+
+def counttype(n):
+    return np.int64 if n < 63 else object
+
+def majority(seats):
+    return sum(seats.values())//2+1
+
+# number of coalitions of each combined weight below /quota/ (indexed [0][weight]),
+# or of each size and combined weight if /sizes/ is set (indexed [size][weight])
+def coalitions(weights, quota, sizes=False):
+    c = np.zeros((len(weights)+1 if sizes else 1, quota), dtype=counttype(len(weights)))
+    c[0, 0] = 1
+    for w in weights:
+        if w >= quota: # any coalition with this party reaches the quota
+            continue
+        if sizes:
+            c[1:, w:] += c[:-1, :quota-w]
+        else:
+            c[0, w:] += c[0, :quota-w]
+    return c
+
+# the coalition counts above without one party of weight /w/ > 0 (undoing its step of the count)
+def without(c, w, quota):
+    d = c.copy()
+    if w >= quota:
+        return d
+    if len(d) > 1: # by size
+        for k in range(1, len(d)):
+            d[k, w:] -= d[k-1, :quota-w]
+    else:
+        for lo in range(w, quota, w):
+            d[0, lo:lo+w] -= d[0, lo-w:min(lo, quota-w)]
+    return d
+
+# Normalised Banzhaf index: the share of a party in all swings, i.e. coalitions that would lose without it
+def banzhaf(seats, quota=None):
+    quota = majority(seats) if quota is None else quota
+    parties = list(seats.keys())
+    weights = [int(seats[p]) for p in parties]
+    c = coalitions(weights, quota)
+    byseats = {0: 0} # parties with equal seats have equal power
+    for w in set(weights)-{0}:
+        byseats[w] = int(without(c, w, quota)[0, max(0, quota-w):].sum())
+    swings = {p: byseats[w] for p, w in zip(parties, weights)}
+    total = sum(swings.values())
+    return {p: swings[p]*1./total if total else 0. for p in parties}
+
+# Shapley-Shubik index: the share of orderings of all parties in which a party brings the coalition of those before it to the quota
+def shapley(seats, quota=None):
+    quota = majority(seats) if quota is None else quota
+    parties = list(seats.keys())
+    weights = [int(seats[p]) for p in parties]
+    n = len(parties)
+    c = coalitions(weights, quota, sizes=True)
+    # share of orderings in which a given party comes right after a given coalition of k others
+    orders = np.array([1./(n*math.comb(n-1, k)) for k in range(n)])
+    power = {}
+    for w in set(weights):
+        if w == 0:
+            power[w] = 0.
+        else:
+            d = without(c, w, quota)
+            power[w] = float(d[:n, max(0, quota-w):].sum(1).astype(float) @ orders)
+    return {p: power[w] for p, w in zip(parties, weights)}
+
+# Deegan-Packel index: power shared equally between the members of each minimal winning coalition
+# (those in which every member is needed), and averaged over these coalitions.
+# With the parties sorted by decreasing seats, a winning coalition is minimal if it falls below the quota
+# without its last (smallest) member, so minimal winning coalitions are counted by their last member j,
+# by each earlier member i, and by the size and weight of the coalition of the other parties before j.
+def deeganpackel(seats, quota=None):
+    quota = majority(seats) if quota is None else quota
+    parties = sorted(seats.keys(), key=lambda l: -seats[l])
+    weights = [int(seats[p]) for p in parties]
+    n = len(parties)
+
+    def add(c, w): # adds a party to the coalitions counted in c
+        if w < quota:
+            c[1:, w:] += c[:-1, :quota-w]
+
+    def shares(c, lo, hi, members): # coalitions weighing lo to hi-1, each with /members/ more members, by member share
+        counts = c[:, max(0, lo):max(0, hi)].sum(1).astype(float)
+        return float(counts @ (1./np.arange(members, members+len(counts))))
+
+    power = [0.]*n
+    before = np.zeros((n+1, quota), dtype=counttype(n)) # coalitions of the parties before i
+    before[0, 0] = 1
+    for i, wi in enumerate(weights):
+        if wi:
+            power[i] += shares(before, quota-wi, quota, 1) # i as the last member
+            others = before.copy() # coalitions of the parties before j, other than i
+            for j in range(i+1, n):
+                if weights[j]:
+                    power[i] += shares(others, quota-weights[j]-wi, quota-wi, 2)
+                add(others, weights[j])
+        add(before, wi)
+    total = sum(power)
+    return {p: power[k]/total if total else 0. for k, p in enumerate(parties)}
+
+# power indices of many seat results (e.g. of an ensemble of simulations), computing each distinct result only once:
+# /results/ is either a list of {party: seats} dicts (giving a list of {party: index} dicts),
+# or a {party: array of seats} dict such as the "seats" of an econf ensemble (giving a {party: array of indices} dict)
+def batch(results, index=banzhaf, quota=None):
+    if isinstance(results, dict):
+        parties = list(results.keys())
+        shape = np.shape(results[parties[0]])
+        rows = [dict(zip(parties, col)) for col in zip(*[np.ravel(results[p]).tolist() for p in parties])]
+        powers = batch(rows, index, quota)
+        return {p: np.array([pw[p] for pw in powers]).reshape(shape) for p in parties}
+    done = {}
+    powers = []
+    for seats in results:
+        key = tuple(seats.items())
+        if key not in done:
+            done[key] = index(seats, quota)
+        powers.append(done[key])
+    return powers